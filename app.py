@@ -1,75 +1,468 @@
 # app.py
-from flask import Flask, render_template, request, jsonify
-import joblib
-import pandas as pd
+from flask import Flask, render_template, request, jsonify, g
 from datetime import datetime
+import importlib
+import io
 import os
+import sys
+import threading
+import time
+from prediction_cache import PredictionCache, file_fingerprint
+from metrics import CONTENT_TYPE, MetricsRegistry
+from model_registry import current_paths
+
+PROCESS_STARTED = time.perf_counter()
 
 app = Flask(__name__)
 
-# Пути к модели и признакам
-MODEL_PATH = "data/ship_price_model.pkl"
-FEATURES_PATH = "data/ship_price_model_features.pkl"
+# LAZY_STARTUP=1: порт открывается сразу, модель грузится в фоновом потоке
+LAZY_STARTUP = os.environ.get('LAZY_STARTUP', '0') == '1'
+
+# Кэш предсказаний: PREDICTION_CACHE_SIZE=0 отключает его, PREDICTION_CACHE_TTL=0 — без срока жизни
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 10000))
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+
+# MICRO_BATCHING=1: одиночные /predict собираются в микропакеты — до MICRO_BATCH_SIZE запросов
+# или MICRO_BATCH_WAIT_MS ожидания — и предсказываются одним вызовом модели
+MICRO_BATCHING = os.environ.get('MICRO_BATCHING', '0') == '1'
+MICRO_BATCH_SIZE = int(os.environ.get('MICRO_BATCH_SIZE', 64))
+MICRO_BATCH_WAIT_MS = float(os.environ.get('MICRO_BATCH_WAIT_MS', 2))
+MICRO_BATCH_WORKERS = int(os.environ.get('MICRO_BATCH_WORKERS', 1))
+
+# Как часто (секунды) проверять манифест реестра моделей на новую версию; 0 — не следить
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', 5))
+
+# Тяжёлые зависимости, время импорта которых отслеживаем (холодный старт). pandas сюда не входит:
+# он нужен только для CSV в /predict/batch и импортируется при первом таком запросе
+HEAVY_MODULES = ('numpy', 'joblib')
+
+
+class LoadedModel:
+    """Загруженная версия модели: всё, что нужно одному запросу, меняется одной ссылкой"""
+
+    def __init__(self, model, encoder, fingerprint, version, load_timings=None):
+        self.model = model
+        self.encoder = encoder
+        self.fingerprint = fingerprint
+        self.version = version
+        self.load_timings = load_timings or {}
+
+
+class ModelLoader:
+    """
+    Загружает модель и кодировщик текущей версии из реестра и запоминает, сколько заняли
+    импорты и загрузка. Новую опубликованную версию загружает и прогревает в фоне, а
+    затем подменяет одной ссылкой — до этого запросы обслуживает прежняя версия.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.error = None
+        self.reload_error = None
+        self.reloads = 0
+        self.reload_failures = 0
+        self._failed_version = None
+        self._reload_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.import_timings = {}
+        # Холодный старт и последняя подмена версии хранятся отдельно: подмена не затирает старт
+        self.load_timings = {}
+        self.last_reload_timings = None
+
+    @property
+    def model(self):
+        return self.current.model if self.current is not None else None
+
+    @property
+    def encoder(self):
+        return self.current.encoder if self.current is not None else None
+
+    @property
+    def fingerprint(self):
+        return self.current.fingerprint if self.current is not None else None
+
+    @property
+    def version(self):
+        return self.current.version if self.current is not None else None
+
+    def timed_import(self, name):
+        """
+        Импортирует модуль и запоминает время первого импорта (0, если модуль уже
+        был загружен до этого); повторные вызовы замер не перезаписывают
+        """
+        already_loaded = name in sys.modules
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        if name not in self.import_timings:
+            self.import_timings[name] = 0.0 if already_loaded else round(time.perf_counter() - started, 4)
+        return module
+
+    def _load_version(self, version, paths):
+        """Загружает и прогревает артефакты версии; ничего не меняет в текущем состоянии"""
+        started = time.perf_counter()
+        timings = {}
+        for name in HEAVY_MODULES:
+            self.timed_import(name)
+
+        from ship_encoder import load_encoder
+        from forest_engine import load_model, model_exists
+
+        if not model_exists(paths['model'], paths['forest']):
+            raise FileNotFoundError(f"❌ Модель не найдена: {paths['model']}. Сначала обучите модель через train_model.py")
+
+        # Плоский лес (mmap) загружается быстрее pickle и делится между воркерами
+        step = time.perf_counter()
+        if not os.path.exists(os.path.join(paths['forest'], 'meta.json')):
+            self.timed_import('sklearn.ensemble')
+        model = load_model(paths['model'], paths['forest'])
+        timings['model'] = round(time.perf_counter() - step, 4)
+
+        step = time.perf_counter()
+        encoder = load_encoder(paths['features'], paths['encoder'])
+        timings['encoder'] = round(time.perf_counter() - step, 4)
+
+        # Отпечаток версии модели — часть ключа кэша, новая версия его меняет
+        step = time.perf_counter()
+        fingerprint = file_fingerprint(paths['model'], paths['forest'])
+        timings['fingerprint'] = round(time.perf_counter() - step, 4)
+
+        # Прогрев: первое предсказание подтягивает страницы модели в память
+        step = time.perf_counter()
+        model.predict_interval(encoder.encode(0, 0, '', '', datetime.now()))
+        timings['warmup'] = round(time.perf_counter() - step, 4)
+
+        timings['total'] = round(time.perf_counter() - started, 4)
+        return LoadedModel(model, encoder, fingerprint, version, timings)
+
+    def load(self):
+        """Загружает текущую версию при старте; ошибки сохраняются в self.error"""
+        try:
+            version, paths = current_paths()
+            self.current = self._load_version(version, paths)
+            self.load_timings = dict(self.current.load_timings)
+            imports = ', '.join(f"{name} {t:.2f}с" for name, t in self.import_timings.items())
+            print(f"✅ Модель {version or paths['model']} загружена за {self.load_timings['total']:.2f}с "
+                  f"(импорты: {imports})")
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            self.load_timings['since_process_start'] = round(time.perf_counter() - PROCESS_STARTED, 4)
+            self.ready.set()
+
+    def reload_if_changed(self):
+        """
+        Если в манифесте реестра новая версия — загружает и прогревает её, затем
+        подменяет текущую. При ошибке продолжает работать прежняя версия.
+        """
+        if not self.ready.is_set():
+            return False
+        version, paths = current_paths()
+        if version is None or version == self.version or version == self._failed_version:
+            return False
+
+        with self._reload_lock:
+            try:
+                loaded = self._load_version(version, paths)
+            except Exception as e:
+                self._failed_version = version
+                self.reload_error = f"{version}: {e}"
+                self.reload_failures += 1
+                app.logger.error("Не удалось загрузить версию модели %s: %s", version, e)
+                return False
+
+            previous = self.version
+            # Подмена одной ссылкой: запрос берёт либо прежнюю версию целиком, либо новую
+            self.current = loaded
+            self.last_reload_timings = loaded.load_timings
+            self.error = self.reload_error = None
+            self.reloads += 1
+            app.logger.info("Модель переключена: %s → %s", previous, version)
+            return True
+
+    def watch(self, interval):
+        """Фоновый поток, который раз в interval секунд проверяет манифест реестра"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload_if_changed()
+                except Exception as e:
+                    app.logger.error("Ошибка проверки реестра моделей: %s", e)
+
+        threading.Thread(target=run, name='model-watcher', daemon=True).start()
+
+    def load_in_background(self):
+        """Запускает загрузку в фоновом потоке, не блокируя старт сервера"""
+        def run():
+            try:
+                self.load()
+            except Exception as e:
+                app.logger.error("Не удалось загрузить модель: %s", e)
+
+        threading.Thread(target=run, name='model-loader', daemon=True).start()
+
+    @property
+    def is_ready(self):
+        return self.ready.is_set() and self.current is not None
+
+
+loader = ModelLoader()
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+
+# Метрики процесса для GET /metrics (у каждого воркера gunicorn — свои)
+registry = MetricsRegistry()
+REQUEST_COUNT = registry.counter('ship_requests_total', "Обработанные HTTP-запросы", ('endpoint', 'method', 'status'))
+REQUEST_LATENCY = registry.histogram('ship_request_duration_seconds', "Полное время обработки запроса", ('endpoint',))
+STAGE_LATENCY = registry.histogram('ship_predict_stage_duration_seconds', "Время этапов предсказания",
+                                   ('endpoint', 'stage'))
+ERROR_COUNT = registry.counter('ship_errors_total', "Ошибки предсказаний по типу исключения",
+                               ('endpoint', 'exception'))
+MICRO_BATCH_SIZES = registry.histogram('ship_micro_batch_size', "Запросов в одном микропакете", (),
+                                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+registry.gauge('ship_model_ready', "1, если модель загружена и принимает запросы", lambda: int(loader.is_ready))
+registry.gauge('ship_prediction_cache_hits_total', "Попадания в кэш предсказаний",
+               lambda: prediction_cache.hits, kind='counter')
+registry.gauge('ship_prediction_cache_misses_total', "Промахи кэша предсказаний",
+               lambda: prediction_cache.misses, kind='counter')
+registry.gauge('ship_model_reloads_total', "Переключения на новую версию модели",
+               lambda: loader.reloads, kind='counter')
+registry.gauge('ship_model_reload_failures_total', "Неудачные загрузки новой версии модели",
+               lambda: loader.reload_failures, kind='counter')
+
+if LAZY_STARTUP:
+    loader.load_in_background()
+else:
+    loader.load()
+if MODEL_RELOAD_INTERVAL > 0:
+    loader.watch(MODEL_RELOAD_INTERVAL)
+
+
+BATCH_COLUMNS = ['dwt', 'year', 'type', 'country', 'date']
 
-# Загружаем модель и список признаков
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"❌ Модель не найдена: {MODEL_PATH}. Сначала обучите модель через train_model.py")
 
-model = joblib.load(MODEL_PATH)
-feature_names = joblib.load(FEATURES_PATH)
+def predict_with_interval(model, X):
+    """(цена, нижняя граница, верхняя граница) для каждой строки — один обход леса"""
+    predictions, bounds = model.predict_interval(X)
+    return [(float(p), float(b[0]), float(b[-1])) for p, b in zip(predictions, bounds)]
+
+
+def predict_ships(ships):
+    """
+    Микропакет запросов (dwt, year, type, country, date): кодирование и предсказание
+    одной и той же версией модели, взятой в момент обработки пакета
+    """
+    loaded = loader.current
+    batch = {col: [ship[i] for ship in ships] for i, col in enumerate(BATCH_COLUMNS)}
+    return predict_with_interval(loaded.model, loaded.encoder.encode_batch(batch))
+
+
+micro_batcher = None
+if MICRO_BATCHING:
+    from micro_batcher import MicroBatcher
+    micro_batcher = MicroBatcher(predict_ships, MICRO_BATCH_SIZE, MICRO_BATCH_WAIT_MS,
+                                 MICRO_BATCH_WORKERS, on_batch=lambda size, _: MICRO_BATCH_SIZES.observe(size))
+
+
+class ModelNotReady(Exception):
+    """Модель ещё загружается (или загрузка не удалась)"""
+
+
+def get_model():
+    """
+    Загруженная версия модели (модель, кодировщик, отпечаток). Запрос работает с ней
+    до конца, даже если в это время подменяется новая версия.
+    """
+    loaded = loader.current
+    if not loader.ready.is_set() or loaded is None:
+        raise ModelNotReady(loader.error or "Модель ещё загружается, повторите запрос через несколько секунд")
+    return loaded
+
+
+def stage(name):
+    """Замер этапа обработки текущего запроса: with stage('encode'): ..."""
+    return STAGE_LATENCY.time(endpoint=request.path, stage=name)
+
+
+def record_error(error):
+    """Учитывает ошибку в /metrics и пишет её в лог — иначе она видна только в ответе"""
+    ERROR_COUNT.inc(endpoint=request.path, exception=type(error).__name__)
+    app.logger.warning("Ошибка %s: %s: %s", request.path, type(error).__name__, error)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # Метка — шаблон маршрута, а не путь: неизвестные адреса не раздувают число рядов
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_COUNT.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
 
 @app.route('/')
 def home():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    # Процесс жив и отвечает — независимо от состояния модели
+    return jsonify({'status': 'ok', 'uptime_s': round(time.perf_counter() - PROCESS_STARTED, 3)})
+
+@app.route('/ready')
+def ready():
+    status = {
+        'ready': loader.is_ready,
+        'lazy_startup': LAZY_STARTUP,
+        'error': loader.error,
+        'load_timings_s': loader.load_timings,
+        'import_timings_s': loader.import_timings,
+        'last_reload_timings_s': loader.last_reload_timings,
+        'model_fingerprint': loader.fingerprint,
+        'model_version': loader.version,
+        'reload_error': loader.reload_error,
+        'micro_batching': micro_batcher.stats() if micro_batcher is not None else None,
+    }
+    return jsonify(status), 200 if loader.is_ready else 503
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    return registry.render(), 200, {'Content-Type': CONTENT_TYPE}
+
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
+        loaded = get_model()
+        model, encoder = loaded.model, loaded.encoder
+        from ship_encoder import parse_date, parse_number
+        from forest_engine import INTERVAL_PERCENTILES
+
         # Получаем данные из формы
-        dwt = float(request.form['dwt'])
-        year = int(request.form['year'])
-        ship_type = request.form['type']
-        country = request.form['country']
-        date_str = request.form['date']
-
-        # Преобразуем дату
-        date_ts = int(datetime.fromisoformat(date_str).timestamp())
-
-        # Создаём DataFrame
-        new_ship = pd.DataFrame({
-            'dwt': [dwt],
-            'year': [year],
-            'date': [date_ts]
-        })
-
-        # One-hot encoding
-        for col in feature_names:
-            if col.startswith('type_'):
-                new_ship[col] = [1 if col == f"type_{ship_type}" else 0]
-            elif col.startswith('country_'):
-                new_ship[col] = [1 if col == f"country_{country}" else 0]
-
-        # Добавляем недостающие столбцы
-        for col in feature_names:
-            if col not in new_ship.columns:
-                new_ship[col] = 0
-
-        # Приводим к правильному порядку
-        new_ship = new_ship[feature_names]
-
-        # Предсказываем
-        predicted_price = model.predict(new_ship)[0]
-
-        return render_template('index.html',
-                             prediction=f"${predicted_price:,.2f}",
-                             dwt=dwt,
-                             year=year,
-                             ship_type=ship_type,
-                             country=country,
-                             date=date_str)
+        with stage('parse_form'):
+            dwt = parse_number(request.form['dwt'])
+            year = int(request.form['year'])
+            ship_type = request.form['type']
+            country = request.form['country']
+            date_str = request.form['date']
+
+        # Дату разбираем один раз: Unix-время идёт и в ключ кэша, и в кодировщик
+        with stage('parse_date'):
+            timestamp = parse_date(date_str)
+
+        # Повторные запросы с теми же данными отдаём из кэша
+        with stage('cache_lookup'):
+            cache_key = (loaded.fingerprint,) + encoder.normalize(dwt, year, ship_type, country, timestamp)
+            cached = prediction_cache.get(cache_key)
 
+        if cached is not None:
+            predicted_price, lower, upper = cached
+        elif micro_batcher is not None:
+            # Микропакет с параллельными запросами: кодируется и предсказывается целиком
+            with stage('predict'):
+                predicted_price, lower, upper = micro_batcher.predict((dwt, year, ship_type, country, date_str))
+        else:
+            # Кодируем признаки
+            with stage('encode'):
+                new_ship = encoder.encode(dwt, year, ship_type, country, timestamp)
+
+            # Предсказываем цену и интервал
+            with stage('predict'):
+                predicted_price, lower, upper = predict_with_interval(model, new_ship)[0]
+
+        if cached is None:
+            prediction_cache.put(cache_key, (predicted_price, lower, upper))
+
+        with stage('render'):
+            return render_template('index.html',
+                                 prediction=f"${predicted_price:,.2f}",
+                                 prediction_range=f"${lower:,.2f} – ${upper:,.2f}",
+                                 interval="–".join(f"P{p}" for p in INTERVAL_PERCENTILES),
+                                 dwt=dwt,
+                                 year=year,
+                                 ship_type=ship_type,
+                                 country=country,
+                                 date=date_str)
+
+    except ModelNotReady as e:
+        record_error(e)
+        return render_template('index.html', error=str(e)), 503
     except Exception as e:
+        record_error(e)
         return render_template('index.html', error=str(e))
 
+def read_batch_request():
+    """Читает пакет судов из JSON или CSV и возвращает словарь столбцов"""
+    uploaded = request.files.get('file')
+    if uploaded is not None or request.mimetype == 'text/csv':
+        pd = loader.timed_import('pandas')
+        raw = uploaded.read() if uploaded is not None else request.get_data()
+        text = raw.decode('utf-8')
+        first_line = text.split('\n', 1)[0]
+        sep = ';' if first_line.count(';') > first_line.count(',') else ','
+        data = pd.read_csv(io.StringIO(text), sep=sep, dtype=str)
+        data.columns = data.columns.str.strip().str.lower()
+        missing = [col for col in BATCH_COLUMNS if col not in data.columns]
+        if missing:
+            raise ValueError(f"Отсутствуют обязательные столбцы: {missing}")
+        return {col: data[col].str.strip().to_numpy() for col in BATCH_COLUMNS}
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('ships')
+    if not isinstance(payload, list):
+        raise ValueError("Ожидается JSON-список судов или объект {\"ships\": [...]}, либо CSV-файл")
+
+    for i, ship in enumerate(payload):
+        if not isinstance(ship, dict):
+            raise ValueError(f"Строка {i + 1}: ожидается объект с полями {BATCH_COLUMNS}, получено {ship!r}")
+    missing = sorted({col for ship in payload for col in BATCH_COLUMNS if col not in ship})
+    if missing:
+        raise ValueError(f"Отсутствуют обязательные поля: {missing}")
+    return {col: [ship[col] for ship in payload] for col in BATCH_COLUMNS}
+
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    try:
+        loaded = get_model()
+        model, encoder = loaded.model, loaded.encoder
+        from forest_engine import INTERVAL_PERCENTILES
+        with stage('parse_request'):
+            batch = read_batch_request()
+        if len(batch['dwt']) == 0:
+            return jsonify({'count': 0, 'predictions': [], 'lower': [], 'upper': []})
+
+        # Одна матрица признаков и один вызов модели на весь пакет
+        with stage('encode'):
+            X = encoder.encode_batch(batch)
+        with stage('predict'):
+            predictions, bounds = model.predict_interval(X)
+
+        with stage('render'):
+            return jsonify({
+                'count': len(predictions),
+                'predictions': [round(float(p), 2) for p in predictions],
+                'lower': [round(float(b), 2) for b in bounds[:, 0]],
+                'upper': [round(float(b), 2) for b in bounds[:, -1]],
+                'interval_percentiles': list(INTERVAL_PERCENTILES),
+            })
+
+    except ModelNotReady as e:
+        record_error(e)
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        record_error(e)
+        return jsonify({'error': str(e)}), 400
+
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
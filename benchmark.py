@@ -0,0 +1,299 @@
+# benchmark.py
+import argparse
+import contextlib
+import io
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import joblib
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import KFold, cross_validate
+import train_model
+from forest_engine import FlatForest, export_forest
+from ship_encoder import ShipEncoder, load_encoder
+
+BENCHMARK_DIR = "data/benchmarks"
+
+# Число типов и стран судов — как в реальной выгрузке. Доли значений неравномерные
+# (см. category_weights): несколько крупных групп и хвост редких
+TYPE_COUNT = 3
+COUNTRY_COUNT = 4
+
+# Размеры пакетов для замера пакетного предсказания
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+
+PERCENTILES = (50, 95, 99)
+
+
+def category_weights(n_values, skew=1.2):
+    """Вероятности значений категории по закону Ципфа: первые значения встречаются чаще"""
+    weights = 1.0 / np.arange(1, n_values + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate_dataset(path, n_rows, n_types=TYPE_COUNT, n_countries=COUNTRY_COUNT, seed=42):
+    """
+    Пишет синтетический CSV в формате выгрузки: разделитель ';', числа вида '10 500 000',
+    даты ДД.ММ.ГГГГ. Цена зависит от дедвейта, возраста, типа и страны постройки.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    ship_type = rng.choice(np.arange(1, n_types + 1), size=n_rows, p=category_weights(n_types))
+    country = rng.choice(np.arange(1, n_countries + 1), size=n_rows, p=category_weights(n_countries))
+    dwt = rng.integers(5_000, 320_000, size=n_rows)
+    year = rng.integers(1990, 2025, size=n_rows)
+    date = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 11 * 365, size=n_rows), unit='D')
+
+    price = (dwt * 180 + (year - 1990) * 450_000 + ship_type * 900_000 + country * 400_000
+             + rng.normal(0, 1_500_000, size=n_rows)).clip(100_000)
+
+    def spaced(values):
+        return pd.Series(values.astype(np.int64)).map('{:,}'.format).str.replace(',', ' ', regex=False)
+
+    pd.DataFrame({
+        'Type': ship_type,
+        'DWT': spaced(dwt),
+        'Year': year,
+        'Country': country,
+        'Date': date.strftime('%d.%m.%Y'),
+        'Price': spaced(price),
+    }).to_csv(path, sep=';', index=False)
+
+
+def latency_stats(samples_s):
+    """p50/p95/p99 и среднее (мс) по замерам в секундах"""
+    samples_ms = np.asarray(samples_s) * 1000
+    stats = {f"p{q}": round(float(np.percentile(samples_ms, q)), 4) for q in PERCENTILES}
+    stats['mean'] = round(float(samples_ms.mean()), 4)
+    return stats
+
+
+def measure_single(predict_fn, encoder, requests):
+    """Задержка одного предсказания, как в /predict: кодирование строки и вызов модели"""
+    samples = []
+    for dwt, year, ship_type, country, date in requests:
+        started = time.perf_counter()
+        predict_fn(encoder.encode(dwt, year, ship_type, country, date))
+        samples.append(time.perf_counter() - started)
+    return latency_stats(samples)
+
+
+def measure_batches(predict_fn, encoder, batch, batch_sizes, repeats):
+    """Задержка пакетного предсказания (кодирование + модель) для каждого размера пакета"""
+    results = {}
+    n_rows = len(batch['dwt'])
+    for size in batch_sizes:
+        if size > n_rows:
+            continue
+        samples = []
+        for i in range(repeats):
+            start = (i * size) % (n_rows - size + 1)
+            part = {col: values[start:start + size] for col, values in batch.items()}
+            started = time.perf_counter()
+            predict_fn(encoder.encode_batch(part))
+            samples.append(time.perf_counter() - started)
+        stats = latency_stats(samples)
+        stats['rows_per_s'] = round(size / np.median(samples), 1)
+        results[str(size)] = stats
+    return results
+
+
+def sample_requests(X, feature_names, n_requests, seed=0):
+    """Входные данные предсказаний (как из формы) из строк подготовленной матрицы"""
+    from datetime import datetime
+
+    encoder = ShipEncoder(feature_names)
+    rng = np.random.default_rng(seed)
+    rows = np.asarray(X)[rng.integers(0, len(X), size=n_requests)]
+
+    def category(row, index):
+        # Значение с единицей в one-hot; нули во всех столбцах — базовая (отброшенная) категория
+        hot = [value for value, col in index.items() if row[col] == 1]
+        return hot[0] if hot else '1'
+
+    return {
+        'dwt': [float(row[encoder.dwt_col]) for row in rows],
+        'year': [int(row[encoder.year_col]) for row in rows],
+        'type': [category(row, encoder.type_index) for row in rows],
+        'country': [category(row, encoder.country_index) for row in rows],
+        'date': [datetime.fromtimestamp(int(row[encoder.date_col])).date().isoformat() for row in rows],
+    }
+
+
+def current_rss_mb():
+    """Текущий RSS процесса (МБ) из /proc/self/statm или None, если его нет (не Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(n_rows, n_types=TYPE_COUNT, n_countries=COUNTRY_COUNT, n_jobs=-1, n_estimators=100,
+        cv_folds=train_model.CV_FOLDS, single_requests=2000, batch_repeats=20, verbose=False):
+    """Прогоняет все этапы на синтетических данных и возвращает словарь результатов"""
+    # Пиковая память (ru_maxrss) — максимум за всю жизнь процесса, поэтому по этапам её не разложить:
+    # для этапа пишем, на сколько изменился текущий RSS, а пик — один раз за прогон
+    stages, rss_delta = {}, {}
+    rss = {'last': current_rss_mb()}
+    # Подробный вывод пайплайна обучения прячем, если не просили --verbose
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+    def record_rss(name):
+        now = current_rss_mb()
+        rss_delta[name] = round(now - rss['last'], 1) if now is not None and rss['last'] is not None else None
+        rss['last'] = now
+
+    def finish(name, started):
+        stages[name] = round(time.perf_counter() - started, 4)
+        record_rss(name)
+        delta = f"{rss_delta[name]:+,.1f} МБ" if rss_delta[name] is not None else "н/д"
+        print(f"⏱️ {name}: {stages[name]:.3f} с (RSS {delta})")
+
+    with tempfile.TemporaryDirectory(prefix='ship-benchmark-') as work_dir:
+        csv_path = os.path.join(work_dir, 'ships.csv')
+        print(f"🧪 Генерируем {n_rows:,} строк ({n_types} типов, {n_countries} стран)...")
+        started = time.perf_counter()
+        generate_dataset(csv_path, n_rows, n_types, n_countries)
+        finish('generate', started)
+
+        # Загрузка и предобработка: обычный путь train_model.load_dataset
+        timer = train_model.PhaseTimer()
+        started = time.perf_counter()
+        with quiet:
+            X, y = train_model.load_dataset(csv_path, timer)
+        total = time.perf_counter() - started
+        stages['load'] = round(timer.phases['Загрузка CSV'], 4)
+        stages['preprocess'] = round(total - timer.phases['Загрузка CSV'], 4)
+        record_rss('preprocess')
+        print(f"⏱️ load: {stages['load']:.3f} с, preprocess: {stages['preprocess']:.3f} с")
+
+        started = time.perf_counter()
+        with quiet:
+            train_model.load_dataset_chunked(csv_path, chunksize=100_000)
+        finish('load_chunked', started)
+
+        feature_names = X.columns.tolist()
+        model = RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=n_jobs)
+        started = time.perf_counter()
+        # Обучаем на матрице без имён столбцов — предсказания ниже тоже идут по матрицам NumPy
+        model.fit(X.to_numpy(), y)
+        finish('fit', started)
+
+        if cv_folds:
+            folds_jobs, trees_jobs = train_model.split_n_jobs(n_jobs, cv_folds)
+            started = time.perf_counter()
+            cross_validate(RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=trees_jobs),
+                           X, y, cv=KFold(n_splits=cv_folds, shuffle=True, random_state=42), n_jobs=folds_jobs,
+                           scoring={'mae': 'neg_mean_absolute_error', 'mse': 'neg_mean_squared_error', 'r2': 'r2'})
+            finish('cv', started)
+
+        # Артефакты: pickle sklearn, плоский лес и кодировщик
+        model_path = os.path.join(work_dir, 'model.pkl')
+        features_path = os.path.join(work_dir, 'features.pkl')
+        encoder_path = os.path.join(work_dir, 'encoder.pkl')
+        forest_path = os.path.join(work_dir, 'forest')
+        started = time.perf_counter()
+        joblib.dump(model, model_path)
+        joblib.dump(feature_names, features_path)
+        ShipEncoder(feature_names).save(encoder_path)
+        export_forest(model, forest_path, feature_names)
+        finish('save_artifacts', started)
+
+        started = time.perf_counter()
+        pickled = joblib.load(model_path)
+        pickled.set_params(n_jobs=1)
+        finish('load_pickle', started)
+        started = time.perf_counter()
+        forest = FlatForest.load(forest_path)
+        encoder = load_encoder(features_path, encoder_path)
+        finish('load_forest', started)
+
+        # Задержки предсказаний: плоский лес (как в app.py) и pickle sklearn для сравнения
+        requests = sample_requests(X, feature_names, max(single_requests, max(BATCH_SIZES)))
+        single = list(zip(*(values[:single_requests] for values in requests.values())))
+        latency = {}
+        for name, engine in (('flat_forest', forest), ('sklearn', pickled)):
+            engine.predict(encoder.encode(*single[0]))
+            started = time.perf_counter()
+            latency[name] = {
+                'single_ms': measure_single(engine.predict, encoder, single),
+                'batch_ms': measure_batches(engine.predict, encoder, requests, BATCH_SIZES, batch_repeats),
+            }
+            finish(f'latency_{name}', started)
+            print(f"   одиночный запрос: p50 {latency[name]['single_ms']['p50']:.3f} мс, "
+                  f"p99 {latency[name]['single_ms']['p99']:.3f} мс")
+
+        # Интервал цены (перцентили по деревьям) считается в том же обходе, что и среднее
+        started = time.perf_counter()
+        interval = latency['flat_forest_interval'] = {
+            'single_ms': measure_single(forest.predict_interval, encoder, single),
+            'batch_ms': measure_batches(forest.predict_interval, encoder, requests, BATCH_SIZES, batch_repeats),
+        }
+        finish('latency_flat_forest_interval', started)
+        point = latency['flat_forest']
+        interval['overhead_p50'] = {
+            size: round(interval['batch_ms'][size]['p50'] / point['batch_ms'][size]['p50'] - 1, 4)
+            for size in interval['batch_ms']
+        }
+        interval['overhead_p50']['single'] = round(interval['single_ms']['p50'] / point['single_ms']['p50'] - 1, 4)
+        print("   надбавка интервала к p50: " + ', '.join(f"{size}: {overhead:+.1%}"
+                                                       for size, overhead in interval['overhead_p50'].items()))
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': {
+            'rows': n_rows, 'types': n_types, 'countries': n_countries, 'n_jobs': n_jobs,
+            'n_estimators': n_estimators, 'cv_folds': cv_folds,
+            'single_requests': single_requests, 'batch_repeats': batch_repeats,
+        },
+        'stages_s': stages,
+        'latency': latency,
+        'rss_delta_mb': rss_delta,
+        'peak_rss_mb': train_model.peak_memory_mb(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк обучения и предсказаний на синтетических данных")
+    parser.add_argument('--rows', type=int, default=100_000, help="Строк в синтетическом наборе")
+    parser.add_argument('--types', type=int, default=TYPE_COUNT, help="Число типов судов")
+    parser.add_argument('--countries', type=int, default=COUNTRY_COUNT, help="Число стран постройки")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="Воркеров для обучения и кросс-валидации")
+    parser.add_argument('--n-estimators', type=int, default=100, help="Деревьев в лесу")
+    parser.add_argument('--cv-folds', type=int, default=train_model.CV_FOLDS,
+                        help="Фолдов кросс-валидации (0 — пропустить этап)")
+    parser.add_argument('--single-requests', type=int, default=2000, help="Замеров одиночного предсказания")
+    parser.add_argument('--batch-repeats', type=int, default=20, help="Замеров на каждый размер пакета")
+    parser.add_argument('--output', default=None,
+                        help=f"JSON с результатами (по умолчанию {BENCHMARK_DIR}/<дата-время>.json)")
+    parser.add_argument('--verbose', action='store_true', help="Показывать вывод пайплайна обучения")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run(args.rows, args.types, args.countries, n_jobs=args.n_jobs, n_estimators=args.n_estimators,
+                  cv_folds=args.cv_folds, single_requests=args.single_requests,
+                  batch_repeats=args.batch_repeats, verbose=args.verbose)
+    output = args.output or os.path.join(BENCHMARK_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    train_model.write_metrics(output, results)
+    if results['peak_rss_mb'] is not None:
+        print(f"💾 Пиковая память процесса за прогон: {results['peak_rss_mb']:,.0f} МБ")
+    print(f"🧾 Результаты сохранены: {output}")
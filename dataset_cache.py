@@ -0,0 +1,125 @@
+# dataset_cache.py
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = "data/cache"
+
+# Меняйте при изменении предобработки — старые записи кэша перестанут подходить
+CACHE_VERSION = 3
+
+# Сколько последних подготовленных наборов хранить
+MAX_ENTRIES = 3
+
+HASH_INDEX = "hash_index.json"
+
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    """Пишет JSON атомарно: во временный файл, затем переименование"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def content_hash(path, cache_dir=CACHE_DIR, chunk_size=1 << 22):
+    """
+    SHA-256 содержимого файла. Хэш запоминается вместе с размером и временем изменения,
+    поэтому неизменённый файл повторно не читается.
+    """
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    index_path = os.path.join(cache_dir, HASH_INDEX)
+    index = _read_json(index_path, {})
+    key = os.path.abspath(path)
+
+    entry = index.get(key)
+    if entry and entry['signature'] == signature:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+
+    os.makedirs(cache_dir, exist_ok=True)
+    index[key] = {'signature': signature, 'sha256': sha256}
+    _write_json(index_path, index)
+    return sha256
+
+
+def cache_key(csv_path, cache_dir=CACHE_DIR):
+    """Ключ записи кэша: хэш содержимого CSV и версия предобработки"""
+    return f"{content_hash(csv_path, cache_dir)[:24]}-v{CACHE_VERSION}"
+
+
+def load_cached_dataset(key, cache_dir=CACHE_DIR):
+    """
+    Загружает подготовленные X и y, отображая массивы в память.
+    Возвращает None, если записи нет или она повреждена.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    meta = _read_json(os.path.join(entry_dir, 'meta.json'), None)
+    if meta is None:
+        return None
+    try:
+        X = np.load(os.path.join(entry_dir, 'X.npy'), mmap_mode='r')
+        y = np.load(os.path.join(entry_dir, 'y.npy'), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if X.shape != (meta['n_rows'], len(meta['columns'])) or len(y) != meta['n_rows']:
+        return None
+
+    # Отмечаем использование — по нему удаляются самые старые записи
+    os.utime(entry_dir)
+    X = pd.DataFrame(X, columns=meta['columns'], copy=False)
+    X.attrs['categories'] = meta.get('categories')
+    X.attrs['date_format'] = meta.get('date_format')
+    return X, pd.Series(y, name='price')
+
+
+def save_cached_dataset(key, X, y, source=None, cache_dir=CACHE_DIR):
+    """Сохраняет X (float32) и y в каталог записи; запись появляется атомарно"""
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, 'X.npy'), np.ascontiguousarray(X, dtype=np.float32))
+    np.save(os.path.join(tmp_dir, 'y.npy'), np.asarray(y, dtype=np.float64))
+    _write_json(os.path.join(tmp_dir, 'meta.json'), {
+        'columns': [str(col) for col in X.columns],
+        'n_rows': int(len(X)),
+        'categories': X.attrs.get('categories'),
+        'date_format': X.attrs.get('date_format'),
+        'source': source,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cache_version': CACHE_VERSION,
+    })
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+    prune_cache(cache_dir)
+    return entry_dir
+
+
+def prune_cache(cache_dir=CACHE_DIR, keep=MAX_ENTRIES):
+    """Удаляет самые давно использованные записи сверх keep"""
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if os.path.isdir(os.path.join(cache_dir, name)) and '.tmp-' not in name]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for entry_dir in entries[keep:]:
+        shutil.rmtree(entry_dir, ignore_errors=True)
@@ -0,0 +1,231 @@
+# forest_engine.py
+import numpy as np
+import json
+import os
+
+FOREST_PATH = "data/ship_price_model_forest"
+
+# Массивы узлов, которые хранятся в отдельных .npy-файлах (для отображения в память)
+NODE_ARRAYS = ('feature', 'threshold', 'children', 'value')
+
+# Перцентили прогнозов деревьев — границы интервала цены
+INTERVAL_PERCENTILES = (10, 90)
+
+# Как часто (в уровнях) убирать из обхода пары «дерево × строка», уже дошедшие до листа
+COMPACT_EVERY = 4
+
+
+class FlatForest:
+    """
+    Лес регрессионных деревьев в виде плоских массивов узлов.
+    Все деревья лежат подряд: roots[i] — индекс корня i-го дерева,
+    children[k] — (левый, правый) потомок узла k.
+    У листьев оба потомка указывают на сам лист, поэтому обход идёт без ветвлений.
+    """
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.feature_names = list(feature_names) if feature_names is not None else None
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def leaf_values(self, X):
+        """
+        Значения листьев всех деревьев для пакета: матрица (n_trees, n_samples).
+        X должен быть конечным: NaN здесь всегда уходит влево, а sklearn обрабатывает его иначе —
+        пропуски отсекает ShipEncoder.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_samples, n_features = X.shape
+        flat_X = X.ravel()
+        flat_children = self.children.reshape(-1)
+
+        # Пары «дерево × строка» идут по уровням одновременно, деревья — блоками по n_samples
+        nodes = np.repeat(np.asarray(self.roots, dtype=np.int64), n_samples)
+        row_offsets = np.tile(np.arange(n_samples, dtype=np.int64) * n_features, self.n_trees)
+        positions = np.arange(len(nodes))
+        leaves = np.empty(len(nodes), dtype=np.int64)
+
+        for depth in range(1, self.max_depth + 1):
+            x = flat_X.take(row_offsets + self.feature.take(nodes))
+            # float32 > float64 — то же сравнение, что и в sklearn (x <= threshold → влево)
+            nodes = flat_children.take(2 * nodes + (x > self.threshold.take(nodes)))
+
+            if depth % COMPACT_EVERY == 0:
+                done = flat_children.take(2 * nodes) == nodes
+                leaves[positions[done]] = nodes[done]
+                active = ~done
+                nodes, row_offsets, positions = nodes[active], row_offsets[active], positions[active]
+                if len(nodes) == 0:
+                    break
+
+        leaves[positions] = nodes
+        return self.value.take(leaves).reshape(self.n_trees, n_samples)
+
+    def predict(self, X, chunk_size=4096):
+        """Средний прогноз по деревьям; пакет обрабатывается кусками, чтобы ограничить память"""
+        X = np.asarray(X)
+        predictions = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start:start + chunk_size]
+            predictions[start:start + len(chunk)] = self.leaf_values(chunk).mean(axis=0)
+        return predictions
+
+    def predict_interval(self, X, percentiles=INTERVAL_PERCENTILES, chunk_size=4096):
+        """
+        Средний прогноз и перцентили по деревьям за один обход: среднее и границы
+        берутся из той же матрицы значений листьев. Возвращает (mean, bounds),
+        bounds — матрица (n_samples, len(percentiles)).
+        """
+        X = np.asarray(X)
+        predictions = np.empty(X.shape[0], dtype=np.float64)
+        bounds = np.empty((X.shape[0], len(percentiles)), dtype=np.float64)
+
+        # Линейная интерполяция между соседними по величине значениями, как в np.percentile,
+        # но по заранее отсортированной матрице — сортировка по оси деревьев в разы дешевле
+        positions = np.asarray(percentiles, dtype=np.float64) / 100 * (self.n_trees - 1)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        weights = (positions - lower)[:, None]
+
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start:start + chunk_size]
+            leaf_values = np.sort(self.leaf_values(chunk), axis=0)
+            predictions[start:start + len(chunk)] = leaf_values.mean(axis=0)
+            bounds[start:start + len(chunk)] = (leaf_values[lower] * (1 - weights) + leaf_values[upper] * weights).T
+        return predictions, bounds
+
+    def extend(self, other, max_trees=None, feature_names=None, keep_first=0):
+        """
+        Новый лес: деревья self, за ними деревья other. При max_trees самые старые
+        деревья отбрасываются, кроме первых keep_first (например, обученных на всей истории).
+        Признаки other могут быть шире — старые деревья используют только первые
+        столбцы, поэтому схему можно расширять в конец.
+        """
+        feature = np.concatenate([self.feature, other.feature])
+        threshold = np.concatenate([self.threshold, other.threshold])
+        value = np.concatenate([self.value, other.value])
+        children = np.concatenate([self.children, np.asarray(other.children) + self.n_nodes])
+        roots = np.concatenate([self.roots, np.asarray(other.roots) + self.n_nodes]).astype(np.int64)
+
+        # Отбрасываем самые старые деревья после первых keep_first: их узлы лежат одним отрезком
+        n_drop = len(roots) - max_trees if max_trees else 0
+        if n_drop > 0:
+            if keep_first + n_drop >= len(roots):
+                raise ValueError(f"❌ max_trees={max_trees} не вмещает {keep_first} закреплённых деревьев и новые")
+            start, end = roots[keep_first], roots[keep_first + n_drop]
+            keep = np.r_[0:start, end:len(feature)]
+            feature, threshold, value = feature[keep], threshold[keep], value[keep]
+            children = children[keep]
+            children = np.where(children >= end, children - (end - start), children)
+            roots = np.concatenate([roots[:keep_first], roots[keep_first + n_drop:] - (end - start)])
+
+        return FlatForest(
+            feature=feature,
+            threshold=threshold,
+            children=children.astype(np.int32),
+            value=value,
+            roots=roots.astype(np.int32),
+            max_depth=max(self.max_depth, other.max_depth),
+            feature_names=feature_names or other.feature_names or self.feature_names,
+        )
+
+    def save(self, path=FOREST_PATH):
+        """Сохраняет лес как каталог .npy-файлов и meta.json"""
+        os.makedirs(path, exist_ok=True)
+        for name in NODE_ARRAYS + ('roots',):
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(getattr(self, name)))
+        meta = {
+            'n_trees': self.n_trees,
+            'n_nodes': self.n_nodes,
+            'max_depth': self.max_depth,
+            'feature_names': self.feature_names,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path=FOREST_PATH, mmap=True):
+        """
+        Загружает лес. При mmap=True массивы отображаются в память, и несколько
+        процессов (воркеров gunicorn) делят одну копию из страничного кэша.
+        """
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in NODE_ARRAYS}
+        roots = np.load(os.path.join(path, 'roots.npy'))
+        return cls(roots=roots, max_depth=meta['max_depth'], feature_names=meta.get('feature_names'), **arrays)
+
+
+def flatten_forest(model, feature_names=None):
+    """Переводит обученный RandomForestRegressor (или ExtraTreesRegressor) в FlatForest"""
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        node_ids = np.arange(n_nodes)
+        is_leaf = tree.children_left == -1
+
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        left = np.where(is_leaf, node_ids, tree.children_left)
+        right = np.where(is_leaf, node_ids, tree.children_right)
+        children.append((np.column_stack([left, right]) + offset).astype(np.int32))
+        values.append(tree.value[:, 0, 0].astype(np.float64))
+        roots.append(offset)
+
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+
+    if feature_names is None and hasattr(model, 'feature_names_in_'):
+        feature_names = model.feature_names_in_.tolist()
+
+    return FlatForest(
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        children=np.concatenate(children),
+        value=np.concatenate(values),
+        roots=np.array(roots, dtype=np.int32),
+        max_depth=max_depth,
+        feature_names=feature_names,
+    )
+
+
+def export_forest(model, path=FOREST_PATH, feature_names=None):
+    """Экспортирует обученный лес в плоский формат для инференса"""
+    forest = flatten_forest(model, feature_names)
+    forest.save(path)
+    return forest
+
+
+def load_model(model_path, forest_path=FOREST_PATH):
+    """
+    Загружает модель для предсказаний: плоский лес, если он экспортирован, иначе —
+    pickle sklearn через joblib, переведённый в плоский лес (для интервалов цены).
+    """
+    if os.path.exists(os.path.join(forest_path, 'meta.json')):
+        return FlatForest.load(forest_path)
+
+    import joblib
+    return flatten_forest(joblib.load(model_path))
+
+
+def model_exists(model_path, forest_path=FOREST_PATH):
+    """Есть ли хотя бы один из артефактов модели"""
+    return os.path.exists(os.path.join(forest_path, 'meta.json')) or os.path.exists(model_path)
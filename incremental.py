@@ -0,0 +1,237 @@
+# incremental.py
+import hashlib
+import io
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.ensemble import ExtraTreesRegressor
+from sklearn.metrics import mean_absolute_error
+from forest_engine import FlatForest, flatten_forest
+from ship_encoder import ShipEncoder
+import model_registry
+import train_model
+
+STATE_PATH = "data/train_state.json"
+
+# Сколько байт перед границей прочитанного хэшируем, чтобы заметить перезапись файла
+TAIL_BYTES = 1 << 16
+
+# Доля новых строк, которая откладывается для оценки дообучения
+HOLDOUT_FRACTION = 0.2
+
+
+def tail_hash(path, offset):
+    """Хэш последних TAIL_BYTES байт перед offset"""
+    start = max(0, offset - TAIL_BYTES)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+
+def load_state(path=STATE_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ Нет состояния обучения {path}. Сначала выполните полное обучение: python train_model.py")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(csv_path, offset, feature_names, categories, rows, n_trees, base_trees, version, date_format,
+               path=STATE_PATH):
+    """
+    Запоминает, докуда прочитан CSV, схему признаков и версию модели, к которой это
+    относится, — следующий запуск в режиме --incremental возьмёт только дописанные после
+    этого строки. base_trees — число деревьев полного обучения в начале леса,
+    date_format — формат дат, определённый по всему файлу (None — ISO 8601).
+    """
+    state = {
+        'csv_path': os.path.abspath(csv_path),
+        'offset': int(offset),
+        'tail_sha256': tail_hash(csv_path, offset),
+        'rows': int(rows),
+        'feature_names': list(feature_names),
+        'categories': categories,
+        'n_trees': int(n_trees),
+        'base_trees': int(base_trees),
+        'version': version,
+        'date_format': date_format,
+        'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return state
+
+
+def complete_size(path):
+    """Размер файла до конца последней полной строки (недописанная строка останется на потом)"""
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        position = size
+        while position > 0:
+            step = min(1 << 16, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+
+def read_appended(csv_path, state):
+    """Байты строк, дописанных после прошлого запуска, и новая граница прочитанного"""
+    offset = state['offset']
+    end = complete_size(csv_path)
+    if end < offset or tail_hash(csv_path, offset) != state['tail_sha256']:
+        raise ValueError(f"❌ Файл {csv_path} изменён не дописыванием в конец. Выполните полное обучение: python train_model.py")
+    with open(csv_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(end - offset), end
+
+
+def extend_schema(feature_names, categories, new_values):
+    """
+    Добавляет столбцы для новых значений категорий в конец списка признаков.
+    Существующие столбцы не переставляются, поэтому старые деревья остаются верными.
+    """
+    feature_names = list(feature_names)
+    categories = {prefix: list(values) for prefix, values in categories.items()}
+    added = []
+    for prefix, values in new_values.items():
+        for value in sorted(set(values) - set(categories[prefix])):
+            categories[prefix].append(value)
+            feature_names.append(f"{prefix}_{value}")
+            added.append(f"{prefix}_{value}")
+    return feature_names, categories, added
+
+
+def encode_rows(arrays, values, feature_names):
+    """Матрица признаков новых строк в схеме feature_names"""
+    column_index = {col: i for i, col in enumerate(feature_names)}
+    X = np.zeros((len(arrays['price']), len(feature_names)), dtype=np.float32)
+    for col in ('dwt', 'year', 'date'):
+        if col in column_index:
+            X[:, column_index[col]] = arrays[col]
+    for prefix in ('type', 'country'):
+        codes = np.array([column_index.get(f"{prefix}_{value}", -1) for value in values[prefix]])
+        columns = codes[arrays[prefix]]
+        known = columns >= 0
+        X[np.flatnonzero(known), columns[known]] = 1
+    return X
+
+
+def update_model(csv_path=train_model.DATA_PATH, n_new_trees=20, max_trees=300,
+                 min_new_rows=50, n_jobs=-1, promote=True):
+    """
+    Дообучение на строках, дописанных в CSV после прошлого запуска:
+    на них строятся новые деревья ExtraTrees, которые добавляются к плоскому лесу.
+    Деревья полного обучения сохраняются всегда, сверх max_trees отбрасываются самые
+    старые из добавленных.
+    """
+    timer = train_model.PhaseTimer()
+    state = load_state()
+    if os.path.abspath(csv_path) != state['csv_path']:
+        raise ValueError(f"❌ Состояние относится к файлу {state['csv_path']}, а не к {csv_path}")
+
+    # Граница прочитанного верна только для той версии, которая её записала: после отката
+    # строки между версиями были бы пропущены
+    current_version, current = model_registry.current_paths()
+    if state.get('version') != current_version:
+        raise ValueError(f"❌ Состояние дообучения относится к версии {state.get('version')}, а текущая — "
+                         f"{current_version}. Выкатите её (python model_registry.py --promote "
+                         f"{state.get('version')}) или выполните полное обучение: python train_model.py")
+    if 'date_format' not in state:
+        raise ValueError("❌ В состоянии дообучения нет формата дат. Выполните полное обучение: python train_model.py")
+    base_trees = state.get('base_trees', 0)
+    if base_trees + n_new_trees > max_trees:
+        raise ValueError(f"❌ В --max-trees {max_trees} не помещаются {base_trees} деревьев полного обучения "
+                         f"и {n_new_trees} новых. Увеличьте --max-trees или выполните полное обучение")
+
+    data, end = read_appended(csv_path, state)
+    if not data.strip():
+        print("✅ Новых строк нет — модель актуальна")
+        return
+
+    sep = train_model.detect_separator(csv_path)
+    header = pd.read_csv(csv_path, sep=sep, encoding='utf-8', nrows=0).columns
+    columns = {col.strip().lower(): col for col in header}
+    # Формат дат — из полного обучения: по нескольким дописанным строкам 05.03 не отличить от 03.05
+    read_options = {'header': None, 'names': list(header),
+                    'date_format': state['date_format'], 'detect_dates': False}
+    try:
+        parts, indexes, total_rows, _ = train_model.read_chunks(
+            io.BytesIO(data), sep, columns, chunksize=100_000, **read_options)
+    except ValueError:
+        parts, indexes, total_rows, _ = train_model.read_chunks(
+            io.BytesIO(data), sep, columns, chunksize=100_000, fast=False, **read_options)
+
+    if not parts['price']:
+        print(f"⚠️ В {total_rows} новых строках нет полных данных — пропускаем их")
+        save_state(csv_path, end, state['feature_names'], state['categories'], state['rows'], state['n_trees'],
+                   base_trees, current_version, state['date_format'])
+        return
+    arrays = {name: np.concatenate(values) for name, values in parts.items()}
+    n_rows = len(arrays['price'])
+    if n_rows < min_new_rows:
+        print(f"⏸️ Новых строк: {n_rows} (< {min_new_rows}) — подождём, пока их накопится больше")
+        return
+    print(f"📥 Новых строк: {n_rows}")
+    timer.lap("Чтение новых строк")
+
+    # Значения категорий по кодам чанков
+    values = {prefix: sorted(index, key=index.get) for prefix, index in indexes.items()}
+    feature_names, categories, added = extend_schema(state['feature_names'], state['categories'], values)
+    if added:
+        print(f"🆕 Новые признаки (добавлены в конец схемы): {added}")
+    X_new = encode_rows(arrays, values, feature_names)
+    y_new = arrays['price']
+
+    forest = FlatForest.load(current['forest'], mmap=False)
+    timer.lap("Подготовка")
+
+    # Оценка: деревья на части новых строк, MAE до и после — на отложенных
+    order = np.random.default_rng(state['rows']).permutation(n_rows)
+    n_holdout = max(1, int(n_rows * HOLDOUT_FRACTION))
+    holdout, fit_rows = order[:n_holdout], order[n_holdout:]
+    check_trees = ExtraTreesRegressor(n_estimators=n_new_trees, random_state=state['rows'], n_jobs=n_jobs)
+    check_trees.fit(X_new[fit_rows], y_new[fit_rows])
+    checked = forest.extend(flatten_forest(check_trees, feature_names), max_trees=max_trees,
+                            feature_names=feature_names, keep_first=base_trees)
+    mae_before = mean_absolute_error(y_new[holdout], forest.predict(X_new[holdout]))
+    mae_after = mean_absolute_error(y_new[holdout], checked.predict(X_new[holdout]))
+    print(f"📊 MAE на {n_holdout} отложенных новых строках: ${mae_before:,.2f} → ${mae_after:,.2f}")
+    timer.lap("Оценка")
+
+    # В модель идут деревья, обученные на всех новых строках
+    print(f"🌲 Строим {n_new_trees} новых деревьев ExtraTrees...")
+    extra_trees = ExtraTreesRegressor(n_estimators=n_new_trees, random_state=state['rows'], n_jobs=n_jobs)
+    extra_trees.fit(X_new, y_new)
+    forest = forest.extend(flatten_forest(extra_trees, feature_names), max_trees=max_trees,
+                           feature_names=feature_names, keep_first=base_trees)
+    timer.lap("Дообучение")
+
+    # Новая версия в реестре: обновлённый лес, схема и кодировщик. Pickle sklearn в неё не
+    # попадает — в нём нет новых деревьев и признаков; model_exists и load_model обходятся лесом
+    staging_dir, paths = model_registry.create_staging()
+    try:
+        forest.save(paths['forest'])
+        joblib.dump(feature_names, paths['features'])
+        ShipEncoder(feature_names).save(paths['encoder'])
+    except Exception:
+        model_registry.discard_staging(staging_dir)
+        raise
+    version = model_registry.publish(staging_dir, make_current=promote, source='incremental', parent=current_version,
+                                     rows=state['rows'] + n_rows, new_rows=n_rows, n_trees=forest.n_trees,
+                                     holdout_mae_before=round(float(mae_before), 2),
+                                     holdout_mae_after=round(float(mae_after), 2))
+    save_state(csv_path, end, feature_names, categories, state['rows'] + n_rows, forest.n_trees,
+               base_trees, version, state['date_format'])
+    print(f"💾 Лес обновлён: {forest.n_trees} деревьев, {len(feature_names)} признаков — версия {version}")
+    if not promote:
+        print(f"⏸️ Версия не сделана текущей. Выкатить: python model_registry.py --promote {version}")
+    timer.lap("Сохранение")
+    timer.report()
@@ -0,0 +1,175 @@
+# micro_batcher.py
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Собирает одиночные запросы на предсказание в микропакеты. Диспетчер ждёт первый
+    запрос, затем добирает следующие, пока пакет не заполнится (max_batch_size) или не
+    истечёт окно max_wait_ms. Пакет уходит в пул воркеров одним вызовом predict_fn:
+    он получает список запросов и возвращает результат для каждого — результаты
+    возвращаются вызывающим через Future.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0, workers=1, on_batch=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = float(max_wait_ms) / 1000
+        self.on_batch = on_batch
+        self._queue = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='micro-batch')
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._dispatcher = threading.Thread(target=self._dispatch, name='micro-batch-dispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, item):
+        """Ставит запрос в очередь; возвращает Future с предсказанием"""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def predict(self, item, timeout=None):
+        """Предсказание для одного запроса: ждёт, пока его пакет будет обработан"""
+        return self.submit(item).result(timeout)
+
+    def _collect(self, first):
+        """Пакет: первый запрос и всё, что успело прийти за окно ожидания"""
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = self._collect(first)
+            self._pool.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        """Один векторный вызов модели на весь пакет"""
+        # Отменённые вызывающими запросы в пакет не попадают
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        started = time.perf_counter()
+        try:
+            predictions = self.predict_fn(items)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, prediction in zip(futures, predictions):
+            future.set_result(prediction)
+
+        with self._lock:
+            self.batches += 1
+            self.items += len(items)
+        if self.on_batch is not None:
+            self.on_batch(len(items), time.perf_counter() - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+                'queued': self._queue.qsize(),
+            }
+
+    def close(self):
+        """Останавливает диспетчер; уже собранные пакеты дорабатываются"""
+        self._queue.put(_STOP)
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
+
+
+def benchmark(model, encoder, clients=32, requests_per_client=200, max_batch_size=64, max_wait_ms=2.0, workers=1):
+    """
+    Пропускная способность при clients одновременных клиентах:
+    предсказание на каждый запрос против микропакетов. Возвращает запросов/с и p99 (мс).
+    """
+    import numpy as np
+    from datetime import date, timedelta
+
+    rng = np.random.default_rng(0)
+    start = date(2015, 1, 1)
+    rows = [encoder.encode(int(rng.integers(5000, 300000)), int(rng.integers(1990, 2025)),
+                           str(rng.integers(1, 4)), str(rng.integers(1, 5)),
+                           (start + timedelta(days=int(rng.integers(0, 3650)))).isoformat()).copy()
+            for _ in range(requests_per_client)]
+
+    def run(predict_one):
+        latencies = []
+        lock = threading.Lock()
+
+        def client():
+            local = []
+            for row in rows:
+                started = time.perf_counter()
+                predict_one(row)
+                local.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return len(latencies) / elapsed, float(np.percentile(latencies, 99)) * 1000
+
+    direct_rps, direct_p99 = run(lambda row: model.predict(row))
+    batcher = MicroBatcher(lambda rows: model.predict(np.vstack(rows)), max_batch_size, max_wait_ms, workers)
+    try:
+        batched_rps, batched_p99 = run(batcher.predict)
+        stats = batcher.stats()
+    finally:
+        batcher.close()
+
+    print(f"⏱️ По одному:   {direct_rps:,.0f} запросов/с, p99 {direct_p99:,.2f} мс")
+    print(f"⏱️ Микропакеты: {batched_rps:,.0f} запросов/с, p99 {batched_p99:,.2f} мс "
+          f"(средний пакет {stats['mean_batch_size']})")
+    print(f"🚀 Ускорение: x{batched_rps / direct_rps:,.1f}")
+    return {'direct_rps': direct_rps, 'direct_p99_ms': direct_p99,
+            'batched_rps': batched_rps, 'batched_p99_ms': batched_p99, **stats}
+
+
+if __name__ == "__main__":
+    import argparse
+    from forest_engine import load_model
+    from model_registry import current_paths
+    from ship_encoder import load_encoder
+
+    parser = argparse.ArgumentParser(description="Сравнение пропускной способности: по одному запросу и микропакетами")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=200, help="Запросов на клиента")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--wait-ms', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    _, paths = current_paths()
+    benchmark(load_model(paths['model'], paths['forest']), load_encoder(paths['features'], paths['encoder']),
+              args.clients, args.requests, args.batch_size, args.wait_ms, args.workers)
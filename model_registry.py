@@ -0,0 +1,132 @@
+# model_registry.py
+import json
+import os
+import shutil
+import time
+
+REGISTRY_DIR = "data/models"
+MANIFEST_NAME = "manifest.json"
+
+# Сколько последних версий хранить (текущая не удаляется никогда)
+MAX_VERSIONS = 5
+
+# Имена артефактов внутри каталога версии
+ARTIFACT_NAMES = {
+    'model': "ship_price_model.pkl",
+    'features': "ship_price_model_features.pkl",
+    'encoder': "ship_price_model_encoder.pkl",
+    'forest': "ship_price_model_forest",
+}
+
+# Раскладка до появления реестра — используется, пока не опубликована ни одна версия
+LEGACY_PATHS = {name: f"data/{file_name}" for name, file_name in ARTIFACT_NAMES.items()}
+
+
+def _write_json(path, data):
+    """Пишет JSON атомарно: во временный файл, затем переименование"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(registry_dir=REGISTRY_DIR):
+    """Манифест реестра или None, если версий ещё нет"""
+    try:
+        with open(os.path.join(registry_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def version_paths(version, registry_dir=REGISTRY_DIR):
+    """Пути к артефактам версии"""
+    version_dir = os.path.join(registry_dir, version)
+    return {name: os.path.join(version_dir, file_name) for name, file_name in ARTIFACT_NAMES.items()}
+
+
+def current_paths(registry_dir=REGISTRY_DIR):
+    """(версия, пути к артефактам) текущей опубликованной модели; без реестра — (None, LEGACY_PATHS)"""
+    manifest = read_manifest(registry_dir)
+    if manifest and manifest.get('current'):
+        return manifest['current'], version_paths(manifest['current'], registry_dir)
+    return None, dict(LEGACY_PATHS)
+
+
+def create_staging(registry_dir=REGISTRY_DIR):
+    """
+    Временный каталог для артефактов новой версии. Читатели его не видят:
+    версия появляется только после publish().
+    """
+    staging_dir = os.path.join(registry_dir, f".staging-{os.getpid()}-{time.time_ns()}")
+    os.makedirs(staging_dir)
+    return staging_dir, {name: os.path.join(staging_dir, file_name) for name, file_name in ARTIFACT_NAMES.items()}
+
+
+def publish(staging_dir, registry_dir=REGISTRY_DIR, make_current=True, **metadata):
+    """
+    Публикует подготовленный каталог как новую версию: каталог переименовывается
+    на место (атомарно), затем атомарно переписывается манифест. Приложение,
+    которое следит за манифестом, увидит либо старую версию, либо новую целиком.
+    С make_current=False версия только сохраняется в реестре — текущей её делает
+    set_current() (python model_registry.py --promote <версия>), например после проверки метрик.
+    """
+    version = time.strftime('%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(os.path.join(registry_dir, version)):
+        suffix += 1
+        version = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}"
+    os.replace(staging_dir, os.path.join(registry_dir, version))
+
+    manifest = read_manifest(registry_dir) or {'versions': []}
+    manifest['versions'].append({
+        'version': version,
+        'published': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        **metadata,
+    })
+    if make_current:
+        manifest['current'] = version
+    dropped = [entry for entry in manifest['versions'][:-MAX_VERSIONS]
+               if entry['version'] != manifest.get('current')]
+    manifest['versions'] = [entry for entry in manifest['versions'] if entry not in dropped]
+    _write_json(os.path.join(registry_dir, MANIFEST_NAME), manifest)
+
+    # Старые версии удаляем только после переключения манифеста. Отображённые в память
+    # файлы остаются доступны процессам, которые их уже открыли
+    for entry in dropped:
+        shutil.rmtree(os.path.join(registry_dir, entry['version']), ignore_errors=True)
+    return version
+
+
+def discard_staging(staging_dir):
+    """Удаляет каталог неопубликованной версии (например, после ошибки обучения)"""
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def set_current(version, registry_dir=REGISTRY_DIR):
+    """Делает текущей одну из сохранённых версий (выкатка проверенной версии или откат)"""
+    manifest = read_manifest(registry_dir)
+    if manifest is None or version not in {entry['version'] for entry in manifest['versions']}:
+        raise ValueError(f"❌ Версия {version} не найдена в реестре {registry_dir}")
+    manifest['current'] = version
+    _write_json(os.path.join(registry_dir, MANIFEST_NAME), manifest)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Версии модели в реестре")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--promote', metavar='VERSION', help="Выкатить версию, опубликованную без переключения")
+    group.add_argument('--rollback', metavar='VERSION', help="Вернуться к одной из прежних версий")
+    args = parser.parse_args()
+
+    target = args.promote or args.rollback
+    if target:
+        set_current(target)
+        print(f"✅ Текущая версия: {target}")
+    manifest = read_manifest() or {'versions': []}
+    for entry in manifest['versions']:
+        marker = '👉' if entry['version'] == manifest.get('current') else '  '
+        details = ', '.join(f"{key}={value}" for key, value in entry.items() if key != 'version')
+        print(f"{marker} {entry['version']}  {details}")
@@ -1,24 +1,37 @@
 # predict_price.py
-import pandas as pd
-import joblib
-from datetime import datetime
+import argparse
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ship_encoder import detect_date_format, load_encoder, parse_number
+from forest_engine import INTERVAL_PERCENTILES, load_model, model_exists
+from model_registry import current_paths
 
-MODEL_PATH = "data/ship_price_model.pkl"
-FEATURES_PATH = "data/ship_price_model_features.pkl"
+# Столбцы входного файла, нужные модели
+INPUT_COLUMNS = ['dwt', 'year', 'type', 'country', 'date']
+PREDICTION_COLUMN = 'predicted_price'
+# Почему строка не оценена (пусто, если оценена) — у таких строк цена и границы пустые
+ERROR_COLUMN = 'prediction_error'
+
+# Модель и кодировщик процесса-воркера (загружаются один раз в initializer)
+_worker_model = None
+_worker_encoder = None
 
 
 def get_user_input():
     """Запрашиваем у пользователя данные нового судна"""
     print("\n=== Введите данные судна для предсказания цены ===")
-    dwt = input("Дедвейт (dwt, например: 60000): ").replace(' ', '')
+    dwt = input("Дедвейт (dwt, например: 60000): ")
     year = int(input("Год постройки (year, например: 2018): "))
     ship_type = input("Тип судна (type, например: 1, 2, 3 — как в данных): ").strip()
     country = input("Страна постройки (country, например: 1, 2, 3 — как в данных): ").strip()
     date_str = input("Дата сделки (date, в формате ГГГГ-ММ-ДД, например: 2025-07-01): ").strip()
 
     return {
-        'dwt': float(dwt),
+        'dwt': parse_number(dwt),
         'year': year,
         'type': ship_type,
         'country': country,
@@ -28,41 +41,25 @@ def get_user_input():
 
 def main():
     print("📂 Загружаем модель...")
-    if not os.path.exists(MODEL_PATH):
-        print(f"❌ Модель не найдена по пути: {MODEL_PATH}")
+    version, paths = current_paths()
+    if not model_exists(paths['model'], paths['forest']):
+        print(f"❌ Модель не найдена по пути: {paths['model']}")
         print("Сначала запустите train_model.py для обучения модели!")
         return
 
-    model = joblib.load(MODEL_PATH)
-    feature_names = joblib.load(FEATURES_PATH)
+    model = load_model(paths['model'], paths['forest'])
+    encoder = load_encoder(paths['features'], paths['encoder'])
 
     # Получаем данные от пользователя
     user_data = get_user_input()
 
-    # Подготавливаем данные для модели
-    new_ship = pd.DataFrame({
-        'dwt': [user_data['dwt']],
-        'year': [user_data['year']],
-        'date': [int(datetime.fromisoformat(user_data['date']).timestamp())]
-    })
-
-    # Добавляем столбцы для type и country (one-hot encoding)
-    for col in feature_names:
-        if col.startswith('type_'):
-            new_ship[col] = [1 if col == f"type_{user_data['type']}" else 0]
-        elif col.startswith('country_'):
-            new_ship[col] = [1 if col == f"country_{user_data['country']}" else 0]
-
-    # Добавляем недостающие столбцы (если вдруг)
-    for col in feature_names:
-        if col not in new_ship.columns:
-            new_ship[col] = 0
-
-    # Приводим к правильному порядку
-    new_ship = new_ship[feature_names]
+    # Кодируем данные для модели
+    new_ship = encoder.encode(user_data['dwt'], user_data['year'], user_data['type'],
+                              user_data['country'], user_data['date'])
 
-    # Предсказываем
-    predicted_price = model.predict(new_ship)[0]
+    # Предсказываем цену и интервал по деревьям
+    predictions, bounds = model.predict_interval(new_ship)
+    predicted_price, lower, upper = predictions[0], bounds[0, 0], bounds[0, -1]
 
     print("\n" + "="*50)
     print("📈 ПРЕДСКАЗАНИЕ ЦЕНЫ")
@@ -74,8 +71,196 @@ def main():
     print(f"Дата сделки:    {user_data['date']}")
     print("-"*50)
     print(f"💰 Предсказанная цена: ${predicted_price:,.2f}")
+    print(f"📏 Диапазон (P{INTERVAL_PERCENTILES[0]}–P{INTERVAL_PERCENTILES[-1]}): ${lower:,.2f} – ${upper:,.2f}")
     print("="*50)
 
 
+def _init_worker(paths):
+    """Загружает модель в процесс-воркер: плоский лес отображается в память и делится между воркерами"""
+    global _worker_model, _worker_encoder
+    _worker_model = load_model(paths['model'], paths['forest'])
+    _worker_encoder = load_encoder(paths['features'], paths['encoder'])
+
+
+def score_batch(batch, date_format=None):
+    """
+    Предсказания, перцентили INTERVAL_PERCENTILES и ошибки строк для словаря столбцов
+    INPUT_COLUMNS: одна матрица признаков и один обход леса. Строки с пустыми или
+    некорректными данными не оцениваются — для них NaN и текст ошибки.
+    """
+    X, problems = _worker_encoder.encode_batch(batch, date_format, errors='mark')
+    predictions, bounds = _worker_model.predict_interval(X)
+    invalid = problems != ''
+    predictions[invalid] = np.nan
+    bounds[invalid] = np.nan
+    return predictions, bounds, problems
+
+
+def iter_input_chunks(path, chunksize):
+    """Читает входной CSV или Parquet чанками по chunksize строк (все значения — строки)"""
+    import pandas as pd
+
+    if path.lower().endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("❌ Для чтения Parquet нужен pyarrow: pip install pyarrow")
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            # Пропуски — пустые строки, как в CSV, а не 'None'/'nan' (их float() принял бы за число)
+            chunk = record_batch.to_pandas()
+            yield chunk.astype(object).where(chunk.notna(), '').astype(str)
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+    sep = ';' if first_line.count(';') > first_line.count(',') else ','
+    yield from pd.read_csv(path, sep=sep, dtype=str, keep_default_na=False, chunksize=chunksize)
+
+
+def chunk_to_batch(chunk, columns):
+    """Столбцы чанка, нужные модели; числа вида '10 500' и '1,5' разбирает кодировщик"""
+    return {col: chunk[columns[col]].str.strip().to_numpy() for col in INPUT_COLUMNS}
+
+
+class ResultWriter:
+    """
+    Дописывает чанки с предсказаниями в CSV или Parquet по мере готовности. Пишет во
+    временный файл рядом с результатом и переименовывает его только в commit() — после
+    сбоя на месте результата не остаётся недописанного файла.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp-{os.getpid()}"
+        self.parquet = path.lower().endswith('.parquet')
+        self._writer = None
+        self.rows = 0
+
+    def write(self, chunk):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.tmp_path, table.schema)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(self.tmp_path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0,
+                         index=False, encoding='utf-8')
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def commit(self):
+        """Закрывает файл и атомарно ставит его на место результата"""
+        self.close()
+        if not os.path.exists(self.tmp_path):
+            open(self.tmp_path, 'w').close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Закрывает и удаляет недописанный временный файл"""
+        self.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def score_file(input_path, output_path, workers=None, chunksize=50_000, max_in_flight=None):
+    """
+    Пакетная оценка: входной файл читается чанками, каждый чанк кодируется матрицей
+    и оценивается в одном из процессов-воркеров. Результаты пишутся по порядку
+    по мере готовности, а в работе одновременно не больше max_in_flight чанков —
+    память не растёт с размером файла.
+    """
+    # Версию модели фиксируем на весь прогон: публикация новой не смешает прогнозы разных версий
+    version, paths = current_paths()
+    if not model_exists(paths['model'], paths['forest']):
+        raise FileNotFoundError(f"❌ Модель не найдена по пути: {paths['model']}. Сначала запустите train_model.py")
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    print(f"📂 Оцениваем {input_path} → {output_path} (воркеров: {workers}, чанк: {chunksize:,} строк, "
+          f"модель: {version or paths['model']})")
+
+    started = time.perf_counter()
+    writer = ResultWriter(output_path)
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(paths,))
+    else:
+        pool = None
+        _init_worker(paths)
+    pending = deque()
+    columns = date_format = None
+    failed = 0
+
+    def flush(pending_chunk):
+        nonlocal failed
+        chunk, result = pending_chunk
+        predictions, bounds, problems = result.result() if pool is not None else result
+        chunk[PREDICTION_COLUMN] = predictions.round(2)
+        for i, percentile in enumerate(INTERVAL_PERCENTILES):
+            chunk[f"price_p{percentile}"] = bounds[:, i].round(2)
+        chunk[ERROR_COLUMN] = problems.astype(str)
+        failed += int((problems != '').sum())
+        writer.write(chunk)
+        elapsed = time.perf_counter() - started
+        print(f"   ✅ {writer.rows:,} строк ({writer.rows / elapsed:,.0f} строк/с)")
+
+    try:
+        for chunk in iter_input_chunks(input_path, chunksize):
+            if columns is None:
+                # Имена столбцов сверяем без учёта регистра и пробелов, формат дат определяем по первому чанку
+                columns = {str(col).strip().lower(): col for col in chunk.columns}
+                missing = [col for col in INPUT_COLUMNS if col not in columns]
+                if missing:
+                    raise ValueError(f"❌ Во входном файле нет столбцов: {missing}")
+                date_format = detect_date_format(chunk[columns['date']].str.strip().unique())
+
+            batch = chunk_to_batch(chunk, columns)
+            if pool is None:
+                pending.append((chunk, score_batch(batch, date_format)))
+            else:
+                pending.append((chunk, pool.submit(score_batch, batch, date_format)))
+            while len(pending) >= max_in_flight:
+                flush(pending.popleft())
+
+        while pending:
+            flush(pending.popleft())
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    writer.commit()
+
+    elapsed = time.perf_counter() - started
+    print(f"💾 Готово: {writer.rows:,} строк за {elapsed:,.1f} с → {output_path}")
+    if failed:
+        print(f"⚠️ Не оценено строк с пустыми или некорректными данными: {failed:,} (причина — в столбце {ERROR_COLUMN})")
+    return writer.rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Предсказание цены судна: интерактивно или для целого файла")
+    parser.add_argument('--input', help="CSV или Parquet с судами (столбцы dwt, year, type, country, date) — пакетный режим")
+    parser.add_argument('--output', help="Куда записать результат (CSV или .parquet); по умолчанию <input>_predictions.csv")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Число процессов-воркеров (по умолчанию — число ядер)")
+    parser.add_argument('--chunksize', type=int, default=50_000, help="Строк в одном чанке")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    if args.input:
+        output = args.output or f"{os.path.splitext(args.input)[0]}_predictions.csv"
+        try:
+            score_file(args.input, output, workers=args.workers, chunksize=args.chunksize)
+        except Exception as e:
+            print(e)
+            sys.exit(1)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+# prediction_cache.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def file_fingerprint(*paths, chunk_size=1 << 20):
+    """
+    Отпечаток версии модели: SHA-256 содержимого файлов артефактов
+    (каталоги обходятся целиком). Переобучение модели меняет отпечаток.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path))
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            continue
+        for file_path in files:
+            digest.update(os.path.basename(file_path).encode('utf-8'))
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class PredictionCache:
+    """
+    Потокобезопасный LRU-кэш предсказаний с ограничением по размеру и времени жизни (TTL).
+    maxsize=0 отключает кэш, ttl=0 — записи живут до вытеснения.
+    """
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Значение по ключу; при попадании запись становится самой свежей"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Сохраняет значение, вытесняя самые давние записи сверх maxsize"""
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Счётчики кэша для мониторинга"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_s': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
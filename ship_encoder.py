@@ -0,0 +1,280 @@
+# ship_encoder.py
+import numpy as np
+import joblib
+import math
+import os
+import threading
+from datetime import datetime
+
+ENCODER_PATH = "data/ship_price_model_encoder.pkl"
+
+# Форматы дат, которые пробуем, если стандартный разбор не справился
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%d.%m.%Y',
+    '%m/%d/%Y',
+    '%Y/%m/%d',
+    '%d-%m-%Y',
+    '%Y.%m.%d'
+]
+
+
+def parse_date(date, date_format=None):
+    """
+    Переводит дату сделки (строка или datetime) в Unix-время, как при обучении.
+    Без date_format строка разбирается как ISO (ГГГГ-ММ-ДД); число считается уже готовым Unix-временем.
+    """
+    if isinstance(date, datetime):
+        return int(date.timestamp())
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    if date_format is not None:
+        return int(datetime.strptime(str(date).strip(), date_format).timestamp())
+    return int(datetime.fromisoformat(str(date).strip()).timestamp())
+
+
+def detect_date_format(dates):
+    """
+    Формат, в котором разбирается больше всего переданных дат: None для ISO, иначе один из
+    DATE_FORMATS. Пустые значения не учитываются, отдельные битые даты формат не сбивают.
+    """
+    dates = [date for date in dates if str(date).strip()]
+    best_format, best_count = None, 0
+    for date_format in [None] + DATE_FORMATS:
+        count = 0
+        for date in dates:
+            try:
+                parse_date(date, date_format)
+                count += 1
+            except ValueError:
+                pass
+        if count == len(dates):
+            return date_format
+        if count > best_count:
+            best_format, best_count = date_format, count
+    if best_count == 0:
+        raise ValueError(f"❌ Не удалось определить формат дат (например, {dates[0]!r}). Пример: 2025-07-01")
+    return best_format
+
+
+def parse_number(value):
+    """
+    Число из входных данных. В строках убираются пробелы (в том числе неразрывные) между
+    разрядами, а запятая считается десятичным разделителем: '10 500 000' и '1,5' — как при обучении.
+    """
+    if isinstance(value, str):
+        value = value.replace(' ', '').replace('\xa0', '').replace(',', '.')
+    return float(value)
+
+
+def _finite(value, name):
+    """Число признака; пропуск, NaN и бесконечность — ошибка (лес отправил бы их по случайной ветке)"""
+    value = parse_number(value)
+    if not math.isfinite(value):
+        raise ValueError(f"❌ Некорректное значение {name}: {value}")
+    return value
+
+
+def _to_float(value):
+    try:
+        return parse_number(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class ShipEncoder:
+    """
+    Кодирует данные судна (dwt, year, type, country, date) в строку признаков модели.
+    Работает без pandas: индексы столбцов one-hot вычислены заранее.
+    """
+
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+        self.column_index = {col: i for i, col in enumerate(self.feature_names)}
+
+        # Числовые признаки: индекс столбца или None, если модель его не использует
+        self.dwt_col = self.column_index.get('dwt')
+        self.year_col = self.column_index.get('year')
+        self.date_col = self.column_index.get('date')
+
+        # Значение категории -> индекс столбца one-hot
+        self.type_index = {col[len('type_'):]: i for col, i in self.column_index.items()
+                           if col.startswith('type_')}
+        self.country_index = {col[len('country_'):]: i for col, i in self.column_index.items()
+                              if col.startswith('country_')}
+
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _row_buffer(self):
+        """Заранее выделенная строка признаков (своя для каждого потока)"""
+        row = getattr(self._local, 'row', None)
+        if row is None:
+            row = np.zeros((1, self.n_features), dtype=np.float32)
+            self._local.row = row
+        return row
+
+    @staticmethod
+    def normalize(dwt, year, ship_type, country, date):
+        """Приводит входные данные к каноническому виду (например, для ключа кэша)"""
+        return _finite(dwt, 'dwt'), int(year), str(ship_type).strip(), str(country).strip(), parse_date(date)
+
+    def encode(self, dwt, year, ship_type, country, date, out=None):
+        """
+        Кодирует одно судно в строку формы (1, n_features) типа float32.
+        Без out возвращается переиспользуемый буфер потока — используйте его до следующего вызова.
+        """
+        row = self._row_buffer() if out is None else out
+        row.fill(0)
+
+        if self.dwt_col is not None:
+            row[0, self.dwt_col] = _finite(dwt, 'dwt')
+        if self.year_col is not None:
+            row[0, self.year_col] = int(year)
+        if self.date_col is not None:
+            row[0, self.date_col] = parse_date(date)
+
+        type_col = self.type_index.get(str(ship_type).strip())
+        if type_col is not None:
+            row[0, type_col] = 1
+        country_col = self.country_index.get(str(country).strip())
+        if country_col is not None:
+            row[0, country_col] = 1
+
+        return row
+
+    def _one_hot_columns(self, values, index):
+        """Индекс столбца one-hot для каждого значения (-1, если столбца нет)"""
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        columns = np.array([index.get(u.strip(), -1) for u in uniques], dtype=np.int64)
+        return columns[inverse.ravel()]
+
+    @staticmethod
+    def _numeric_column(values, name, problems):
+        """Столбец float64; пустые, нечисловые и бесконечные значения отмечаются в problems и заменяются нулём"""
+        try:
+            column = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            column = np.array([_to_float(v) for v in values], dtype=np.float64)
+        bad = ~np.isfinite(column)
+        for i in np.flatnonzero(bad):
+            problems[i] = problems[i] or f"некорректное значение {name}: {values[i]!r}"
+        column[bad] = 0
+        return column
+
+    def encode_batch(self, batch, date_format=None, errors='raise'):
+        """
+        Кодирует пакет судов в матрицу (n, n_features) одним проходом NumPy.
+        batch — словарь столбцов: dwt, year, type, country, date.
+        Строки с пустым или нечисловым dwt/year и неразбираемой датой:
+        errors='raise' — ValueError с номером первой такой строки (нумерация с 1);
+        errors='mark' — возвращается (X, problems): текст ошибки для таких строк ('' для остальных),
+        их признаки заполнены нулями.
+        """
+        n_rows = len(batch['dwt'])
+        X = np.zeros((n_rows, self.n_features), dtype=np.float32)
+        rows = np.arange(n_rows)
+        problems = np.full(n_rows, '', dtype=object)
+
+        if self.dwt_col is not None:
+            X[:, self.dwt_col] = self._numeric_column(batch['dwt'], 'dwt', problems)
+        if self.year_col is not None:
+            X[:, self.year_col] = self._numeric_column(batch['year'], 'year', problems)
+        if self.date_col is not None:
+            # Даты разбираем только по уникальным значениям
+            uniques, inverse = np.unique(np.asarray(batch['date'], dtype=str), return_inverse=True)
+            inverse = inverse.ravel()
+            timestamps = np.zeros(len(uniques), dtype=np.int64)
+            failed = np.zeros(len(uniques), dtype=bool)
+            for i, date in enumerate(uniques):
+                try:
+                    timestamps[i] = parse_date(date, date_format)
+                except (ValueError, OverflowError, OSError):
+                    failed[i] = True
+            X[:, self.date_col] = timestamps[inverse]
+            for i in np.flatnonzero(failed[inverse]):
+                problems[i] = problems[i] or f"некорректная дата: {batch['date'][i]!r}"
+
+        # One-hot: ставим единицы сразу для всех строк
+        for key, index in (('type', self.type_index), ('country', self.country_index)):
+            columns = self._one_hot_columns(batch[key], index)
+            known = columns >= 0
+            X[rows[known], columns[known]] = 1
+
+        bad_rows = np.flatnonzero(problems != '')
+        if errors == 'mark':
+            X[bad_rows] = 0
+            return X, problems
+        if len(bad_rows):
+            first = int(bad_rows[0])
+            more = f" (всего строк с ошибками: {len(bad_rows)})" if len(bad_rows) > 1 else ''
+            raise ValueError(f"❌ Строка {first + 1}: {problems[first]}{more}")
+        return X
+
+    def save(self, path=ENCODER_PATH):
+        """Сохраняет кодировщик рядом с моделью"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump(self, path)
+
+
+def load_encoder(features_path, encoder_path=ENCODER_PATH):
+    """
+    Загружает сохранённый кодировщик. Для моделей, обученных до его появления,
+    собирает кодировщик из списка признаков.
+    """
+    if os.path.exists(encoder_path):
+        return joblib.load(encoder_path)
+    return ShipEncoder(joblib.load(features_path))
+
+
+def _encode_with_pandas(feature_names, dwt, year, ship_type, country, date_str):
+    """Прежний способ кодирования через DataFrame — только для сравнения в бенчмарке"""
+    import pandas as pd
+
+    new_ship = pd.DataFrame({
+        'dwt': [dwt],
+        'year': [year],
+        'date': [int(datetime.fromisoformat(date_str).timestamp())]
+    })
+    for col in feature_names:
+        if col.startswith('type_'):
+            new_ship[col] = [1 if col == f"type_{ship_type}" else 0]
+        elif col.startswith('country_'):
+            new_ship[col] = [1 if col == f"country_{country}" else 0]
+    for col in feature_names:
+        if col not in new_ship.columns:
+            new_ship[col] = 0
+    return new_ship[feature_names]
+
+
+def benchmark(feature_names, repeats=10000):
+    """Микробенчмарк: задержка кодирования одной строки (мкс) — ShipEncoder против pandas"""
+    import timeit
+
+    encoder = ShipEncoder(feature_names)
+    args = (60000.0, 2018, '2', '3', '2025-07-01')
+
+    encoder_us = min(timeit.repeat(lambda: encoder.encode(*args), number=repeats, repeat=5)) / repeats * 1e6
+    pandas_repeats = max(1, repeats // 100)
+    pandas_us = min(timeit.repeat(lambda: _encode_with_pandas(feature_names, *args),
+                                  number=pandas_repeats, repeat=3)) / pandas_repeats * 1e6
+
+    print(f"⏱️ ShipEncoder.encode: {encoder_us:,.2f} мкс/строка")
+    print(f"⏱️ pandas DataFrame:   {pandas_us:,.2f} мкс/строка")
+    print(f"🚀 Ускорение: x{pandas_us / encoder_us:,.0f}")
+    return {'encoder_us': encoder_us, 'pandas_us': pandas_us}
+
+
+if __name__ == "__main__":
+    from model_registry import current_paths
+    _, paths = current_paths()
+    benchmark(joblib.load(paths['features']))
@@ -1,17 +1,72 @@
 # train_model.py
 import pandas as pd
-from sklearn.model_selection import train_test_split, KFold, cross_val_score
+from sklearn.model_selection import train_test_split, KFold, cross_validate
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.base import clone
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import numpy as np
 import joblib
+import argparse
+import json
+import multiprocessing
 import os
-import matplotlib.pyplot as plt
+import sys
+import time
+from ship_encoder import ShipEncoder, detect_date_format
+from forest_engine import export_forest
+import model_registry
+from dataset_cache import cache_key, load_cached_dataset, save_cached_dataset
 
 # Путь к данным
 DATA_PATH = "data/ships.csv"
-MODEL_PATH = "data/ship_price_model.pkl"
-FEATURES_PATH = "data/ship_price_model_features.pkl"
+METRICS_PATH = "data/metrics.json"
+CV_PLOT_PATH = "data/cv_results.png"
+DIAGNOSTICS_PLOT_PATH = "data/model_diagnostics.png"
+
+CV_FOLDS = 5
+
+# Сетка для подбора гиперпараметров (--tune)
+PARAM_GRID = {
+    'n_estimators': [100, 200, 400],
+    'max_depth': [None, 12, 24],
+    'max_features': [1.0, 0.5, 'sqrt'],
+    'min_samples_leaf': [1, 3, 10],
+}
+HALVING_FACTOR = 3
+# На меньших подвыборках сравнение конфигураций — почти случайность
+TUNE_MIN_ROWS = 1000
+
+REQUIRED_COLUMNS = ['type', 'dwt', 'year', 'country', 'date', 'price']
+
+
+class PhaseTimer:
+    """Замеряет wall-clock время этапов пайплайна"""
+
+    def __init__(self):
+        self.phases = {}
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        """Завершает этап name: время с предыдущей отметки"""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+        self._last = now
+        print(f"⏱️ {name}: {elapsed:.2f} с")
+        return elapsed
+
+    def restart(self):
+        """Сбрасывает отметку, не засчитывая время (например, ожидание закрытия окна графика)"""
+        self._last = time.perf_counter()
+
+    def report(self):
+        """Печатает сводку по этапам"""
+        total = sum(self.phases.values())
+        print("\n⏱️ Время по этапам:")
+        for name, elapsed in self.phases.items():
+            share = elapsed / total * 100 if total else 0
+            print(f"   {name:<32} {elapsed:8.2f} с  ({share:4.1f}%)")
+        print(f"   {'Итого':<32} {total:8.2f} с")
 
 
 def detect_separator(file_path, sample_lines=5):
@@ -42,33 +97,33 @@ def clean_numeric_column(series):
     return series
 
 
-def main():
-    print("🚀 Загружаем данные из файла:", DATA_PATH)
-
+def load_dataset(path, timer=None):
+    """Читает CSV целиком и готовит признаки X и цель y"""
     # Проверяем, существует ли файл
-    if not os.path.exists(DATA_PATH):
-        raise FileNotFoundError(f"❌ Файл {DATA_PATH} не найден. Проверьте путь и наличие файла.")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ Файл {path} не найден. Проверьте путь и наличие файла.")
 
     # Определяем разделитель
-    sep = detect_separator(DATA_PATH)
+    sep = detect_separator(path)
     print(f"🔍 Определён разделитель: '{sep}'")
 
     # Загружаем данные
     try:
-        data = pd.read_csv(DATA_PATH, sep=sep, encoding='utf-8')
+        data = pd.read_csv(path, sep=sep, encoding='utf-8')
         print("✅ Файл успешно прочитан")
     except Exception as e:
         raise Exception(f"❌ Ошибка при чтении файла: {e}")
+    if timer is not None:
+        timer.lap("Загрузка CSV")
 
     # Очищаем названия столбцов: убираем пробелы, приводим к нижнему регистру
     data.columns = data.columns.str.strip().str.lower()
     print("📊 Столбцы после очистки:", data.columns.tolist())
 
     # Проверяем обязательные столбцы
-    required_columns = ['type', 'dwt', 'year', 'country', 'date', 'price']
-    missing_columns = [col for col in required_columns if col not in data.columns]
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in data.columns]
     if missing_columns:
-        raise ValueError(f"❌ Отсутствуют обязательные столбцы: {missing_columns}. Проверьте файл {DATA_PATH}")
+        raise ValueError(f"❌ Отсутствуют обязательные столбцы: {missing_columns}. Проверьте файл {path}")
 
     # Проверяем типы данных до очистки
     print("\n🔍 Типы данных до преобразований:")
@@ -91,38 +146,12 @@ def main():
     if len(data) == 0:
         raise ValueError("❌ Все строки содержали NaN — данные пусты!")
 
-    # Преобразуем дату — с обработкой ошибок
+    # Преобразуем дату: формат подбирается так же, как при потоковом чтении и пакетной оценке
     print("📅 Преобразуем столбец 'date'...")
-    try:
-        # Пробуем стандартное преобразование
-        data['date'] = pd.to_datetime(data['date'], errors='raise').astype('int64') // 10**9
-        print("✅ Дата успешно преобразована (стандартный формат)")
-    except Exception as e:
-        print(f"⚠️ Ошибка при стандартном преобразовании: {e}")
-        print("💡 Пробуем альтернативные форматы...")
-
-        # Пробуем другие форматы
-        formats_to_try = [
-            '%Y-%m-%d',
-            '%d.%m.%Y',
-            '%m/%d/%Y',
-            '%Y/%m/%d',
-            '%d-%m-%Y',
-            '%Y.%m.%d'
-        ]
-
-        success = False
-        for fmt in formats_to_try:
-            try:
-                data['date'] = pd.to_datetime(data['date'], format=fmt).astype('int64') // 10**9
-                print(f"✅ Дата успешно преобразована с форматом: {fmt}")
-                success = True
-                break
-            except:
-                continue
-
-        if not success:
-            raise ValueError(f"❌ Не удалось преобразовать столбец 'date'. Проверьте формат дат в файле. Пример: 2025-07-01")
+    dates = data['date'].astype(str)
+    date_format = detect_date_format(dates.unique())
+    data['date'] = parse_dates(dates, date_format)
+    print(f"✅ Дата успешно преобразована с форматом: {date_format or 'ISO 8601'}")
 
     # One-hot encoding для категориальных признаков
     print("🔤 Кодируем столбцы 'type' и 'country'...")
@@ -130,6 +159,7 @@ def main():
         # Убедимся, что type и country — строки, а не числа
         data['type'] = data['type'].astype(str)
         data['country'] = data['country'].astype(str)
+        categories = {col: sorted(data[col].unique().tolist()) for col in ('type', 'country')}
         data = pd.get_dummies(data, columns=['type', 'country'], drop_first=True)
     except Exception as e:
         raise Exception(f"❌ Ошибка при кодировании категорий: {e}")
@@ -141,41 +171,170 @@ def main():
     # Разделяем на признаки и целевую переменную
     X = data.drop('price', axis=1)
     y = data['price']
+    # Все значения категорий (вместе с отброшенной первой) — для дообучения на новых строках
+    X.attrs['categories'] = categories
+    # Формат дат — чтобы дообучение разбирало дописанные строки так же, а не угадывало заново
+    X.attrs['date_format'] = date_format
 
-    print(f"\n📊 Размер данных после обработки: {X.shape[0]} строк, {X.shape[1]} признаков")
-    if X.shape[0] == 0 or X.shape[1] == 0:
-        raise ValueError("❌ Данные пусты после обработки. Проверьте входной файл.")
+    return X, y
 
-    # Разделяем на обучающую и тестовую выборки
-    print("🧩 Разделяем данные на обучающую и тестовую выборки...")
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
 
-    # Создаём и обучаем модель
-    print("🤖 Обучаем модель Random Forest...")
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
+# Одна замена за проход: убираем пробелы (в т.ч. неразрывные), запятую меняем на точку
+NUMERIC_TRANSLATION = str.maketrans({' ': None, '\xa0': None, ',': '.'})
+
+
+def peak_memory_mb():
+    """Пиковое потребление памяти процессом (МБ) или None, если платформа не позволяет узнать"""
     try:
-        model.fit(X_train, y_train)
-    except Exception as e:
-        raise Exception(f"❌ Ошибка при обучении модели: {e}")
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
 
-    # 🔄 Кросс-валидация на обучающей выборке
-    print("\n🧪 Запускаем кросс-валидацию (5 фолдов)...")
-    cv = KFold(n_splits=5, shuffle=True, random_state=42)
 
-    # MAE
-    cv_scores_mae = -cross_val_score(model, X_train, y_train, cv=cv, scoring='neg_mean_absolute_error')
-    # RMSE
-    cv_scores_rmse = np.sqrt(-cross_val_score(model, X_train, y_train, cv=cv, scoring='neg_mean_squared_error'))
-    # R²
-    cv_scores_r2 = cross_val_score(model, X_train, y_train, cv=cv, scoring='r2')
+def normalize_numeric(series):
+    """Переводит столбец с числами вида '10 500 000' или '1,5' в float за один проход по строкам"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    return pd.to_numeric(series.str.translate(NUMERIC_TRANSLATION), errors='raise')
 
-    print(f"📊 CV MAE: ${cv_scores_mae.mean():,.2f} ± ${cv_scores_mae.std():,.2f}")
-    print(f"📊 CV RMSE: ${cv_scores_rmse.mean():,.2f} ± ${cv_scores_rmse.std():,.2f}")
-    print(f"📊 CV R²: {cv_scores_r2.mean():.3f} ± {cv_scores_r2.std():.3f}")
 
-    # 📊 Визуализация кросс-валидации
+def category_codes(series, index):
+    """Коды категорий чанка в общей нумерации index (новые значения дописываются в конец)"""
+    categories = series.cat.categories.astype(str).str.strip()
+    mapping = np.array([index.setdefault(value, len(index)) for value in categories], dtype=np.int32)
+    return mapping[series.cat.codes.to_numpy()]
+
+
+def parse_dates(dates, date_format):
+    """Переводит даты чанка в Unix-время, разбирая каждое уникальное значение один раз"""
+    codes, uniques = pd.factorize(dates)
+    try:
+        # date_format=None — ISO 8601, как в ship_encoder.parse_date
+        parsed = pd.to_datetime(pd.Series(uniques), format=date_format or 'ISO8601', errors='raise')
+    except ValueError as e:
+        raise ValueError(f"❌ Не удалось преобразовать столбец 'date' в формате {date_format}: {e}")
+    return parsed.to_numpy().astype('datetime64[s]').astype(np.int64)[codes]
+
+
+def read_chunks(source, sep, columns, chunksize, fast=True, date_format=None, detect_dates=True, **read_options):
+    """
+    Читает CSV (путь или файловый объект) чанками и складывает компактные массивы по столбцам.
+    fast=True: числа вида '10 500 000' разбирает сам C-парсер pandas (thousands=' ');
+    fast=False: числа читаются строками и чистятся за один проход str.translate.
+    date_format — формат дат (None — ISO 8601); при detect_dates=True он определяется по первому
+    непустому чанку. Возвращает массивы, индексы категорий, число строк и формат дат.
+    """
+    numeric_dtype = 'float64' if fast else 'string'
+    dtypes = {
+        columns['dwt']: numeric_dtype,
+        columns['price']: numeric_dtype,
+        columns['year']: 'float64',
+        columns['date']: 'string',
+        columns['type']: 'category',
+        columns['country']: 'category',
+    }
+    if fast:
+        read_options.update(thousands=' ', decimal=',' if sep == ';' else '.')
+    reader = pd.read_csv(source, sep=sep, encoding='utf-8', usecols=list(dtypes), dtype=dtypes,
+                         chunksize=chunksize, **read_options)
+
+    parts = {name: [] for name in ('dwt', 'year', 'date', 'price', 'type', 'country')}
+    indexes = {'type': {}, 'country': {}}
+    total_rows = 0
+
+    for chunk in reader:
+        chunk.columns = chunk.columns.str.strip().str.lower()
+        total_rows += len(chunk)
+        if not fast:
+            try:
+                chunk['dwt'] = normalize_numeric(chunk['dwt'])
+                chunk['price'] = normalize_numeric(chunk['price'])
+            except Exception as e:
+                raise ValueError(f"❌ Ошибка при преобразовании числовых столбцов: {e}. Проверьте формат чисел в файле.")
+
+        chunk = chunk.dropna()
+        if len(chunk) == 0:
+            continue
+
+        if detect_dates:
+            date_format = detect_date_format(chunk['date'].unique())
+            detect_dates = False
+            print(f"📅 Формат дат: {date_format or 'ISO 8601'}")
+
+        parts['dwt'].append(chunk['dwt'].to_numpy(dtype=np.float64))
+        parts['year'].append(chunk['year'].to_numpy(dtype=np.float64))
+        parts['date'].append(parse_dates(chunk['date'], date_format))
+        parts['price'].append(chunk['price'].to_numpy(dtype=np.float64))
+        for name, index in indexes.items():
+            parts[name].append(category_codes(chunk[name], index))
+
+    return parts, indexes, total_rows, date_format
+
+
+def load_dataset_chunked(path, chunksize=100_000):
+    """
+    Потоково читает большой CSV чанками с явными типами и готовит X и y.
+    В памяти держатся только компактные числовые массивы, а не весь файл строками.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ Файл {path} не найден. Проверьте путь и наличие файла.")
+
+    sep = detect_separator(path)
+    print(f"🔍 Определён разделитель: '{sep}'")
+
+    # Имена столбцов нормализуем так же, как при обычной загрузке
+    header = pd.read_csv(path, sep=sep, encoding='utf-8', nrows=0).columns
+    columns = {col.strip().lower(): col for col in header}
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_columns:
+        raise ValueError(f"❌ Отсутствуют обязательные столбцы: {missing_columns}. Проверьте файл {path}")
+
+    print(f"📦 Читаем файл чанками по {chunksize:,} строк...")
+    try:
+        parts, indexes, total_rows, date_format = read_chunks(path, sep, columns, chunksize, fast=True)
+    except ValueError as e:
+        print(f"⚠️ Быстрый разбор чисел не удался ({e}). Читаем числа как строки...")
+        parts, indexes, total_rows, date_format = read_chunks(path, sep, columns, chunksize, fast=False)
+
+    print(f"🧹 Исходное количество строк: {total_rows}")
+    if not parts['price']:
+        raise ValueError("❌ Все строки содержали NaN — данные пусты!")
+    arrays = {name: np.concatenate(values) for name, values in parts.items()}
+    n_rows = len(arrays['price'])
+    print(f"🧹 После удаления NaN: {n_rows} строк")
+
+    # One-hot как в pd.get_dummies(drop_first=True): категории по алфавиту, первая отбрасывается
+    dummies = []
+    for prefix, index in indexes.items():
+        for value in sorted(index)[1:]:
+            dummies.append((f"{prefix}_{value}", prefix, index[value]))
+
+    # Числовые признаки — в порядке столбцов файла, как при обычной загрузке
+    numeric = [col for col in (c.strip().lower() for c in header) if col in ('dwt', 'year', 'date')]
+    feature_names = numeric + [name for name, _, _ in dummies]
+
+    X = np.zeros((n_rows, len(feature_names)), dtype=np.float32)
+    for i, col in enumerate(numeric):
+        X[:, i] = arrays[col]
+    for i, (_, prefix, code) in enumerate(dummies, start=len(numeric)):
+        X[:, i] = arrays[prefix] == code
+
+    peak = peak_memory_mb()
+    if peak is not None:
+        print(f"💾 Пиковая память после загрузки: {peak:,.0f} МБ")
+    X = pd.DataFrame(X, columns=feature_names, copy=False)
+    X.attrs['categories'] = {prefix: sorted(index) for prefix, index in indexes.items()}
+    X.attrs['date_format'] = date_format
+    return X, pd.Series(arrays['price'], name='price')
+
+
+def plot_cv_results(cv_scores_mae, cv_scores_rmse, cv_scores_r2, path=CV_PLOT_PATH):
+    """Столбчатые графики метрик по фолдам кросс-валидации"""
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1, 3, figsize=(18, 5))
 
     # MAE
@@ -206,10 +365,273 @@ def main():
     ax[2].grid(True, alpha=0.3)
 
     plt.tight_layout()
-    plt.savefig('data/cv_results.png', dpi=150, bbox_inches='tight')
-    print("\n📊 График кросс-валидации сохранён: data/cv_results.png")
+    plt.savefig(path, dpi=150, bbox_inches='tight')
+    print(f"\n📊 График кросс-валидации сохранён: {path}")
+    return fig
+
+
+def plot_diagnostics(y_test, y_pred, path=DIAGNOSTICS_PLOT_PATH):
+    """Истинные vs предсказанные цены и распределение ошибок на тестовой выборке"""
+    import matplotlib.pyplot as plt
+
+    print("\n🖼️ Строим графики истинных vs предсказанных цен...")
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
+
+    # График 1: Истинные vs Предсказанные цены
+    ax1.scatter(y_test, y_pred, alpha=0.7, color='#3498db', edgecolors='w', s=60)
+    ax1.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--', lw=2, label='Идеальное предсказание')
+    ax1.set_xlabel('Истинная цена ($)', fontsize=12)
+    ax1.set_ylabel('Предсказанная цена ($)', fontsize=12)
+    ax1.set_title('Истинные vs Предсказанные цены', fontsize=14, fontweight='bold')
+    ax1.legend()
+    ax1.grid(True, alpha=0.3)
+
+    # График 2: Распределение ошибок
+    errors = y_test - y_pred
+    ax2.hist(errors, bins=30, color='#e74c3c', edgecolor='black', alpha=0.7)
+    ax2.set_xlabel('Ошибка (Истинная - Предсказанная)', fontsize=12)
+    ax2.set_ylabel('Количество', fontsize=12)
+    ax2.set_title('Распределение ошибок', fontsize=14, fontweight='bold')
+    ax2.grid(True, alpha=0.3)
+
+    plt.tight_layout()
+    plt.savefig(path, dpi=150, bbox_inches='tight')
+    print(f"📊 Диагностические графики сохранены: {path}")
+    return fig
+
+
+def show_plots():
+    """Показывает построенные графики в интерактивном окне"""
+    import matplotlib.pyplot as plt
     plt.show()
 
+
+def render_plots(cv_scores, y_test, y_pred):
+    """Строит графики без дисплея (backend Agg) — для фонового процесса в headless-режиме"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plot_cv_results(*cv_scores)
+    plot_diagnostics(y_test, y_pred)
+    plt.close('all')
+
+
+def write_metrics(path, metrics):
+    """Пишет метрики в JSON атомарно — планировщик не увидит недописанный файл"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def split_n_jobs(n_jobs, n_folds=CV_FOLDS):
+    """
+    Делит воркеров между фолдами и деревьями: фолды идут параллельно, а внутри фолда
+    деревья строятся на оставшихся ядрах. Потоков на деревья — с округлением вверх, чтобы
+    ядра не простаивали (8 ядер, 5 фолдов → 5 × 2): небольшая переподписка лесу не мешает.
+    """
+    total = joblib.effective_n_jobs(n_jobs)
+    folds_jobs = min(n_folds, total)
+    trees_jobs = max(1, -(-total // folds_jobs))
+    return folds_jobs, trees_jobs
+
+
+def tune_hyperparameters(X_train, y_train, n_jobs=-1, compare_grid=False):
+    """
+    Подбор гиперпараметров Random Forest последовательным делением пополам (successive halving):
+    все конфигурации сначала оцениваются на малой подвыборке, в следующий раунд проходит
+    лучшая треть, которой достаётся втрое больше строк. Явно худшие конфигурации
+    отсеиваются, не дойдя до обучения на полных данных. Последний раунд идёт на
+    min_rows × factor^k строках — это все строки без остатка от деления (меньше factor^k).
+    Лучшая конфигурация затем обучается на всей выборке на всех n_jobs. Если строк меньше
+    TUNE_MIN_ROWS × HALVING_FACTOR, подвыборки не было бы — тогда сетка перебирается целиком.
+    """
+    from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+    from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV
+
+    cv = KFold(n_splits=CV_FOLDS, shuffle=True, random_state=42)
+    n_candidates = int(np.prod([len(values) for values in PARAM_GRID.values()]))
+    workers = joblib.effective_n_jobs(n_jobs)
+    print(f"\n🎛️ Подбор гиперпараметров: {n_candidates} конфигураций, воркеров: {workers}")
+
+    # Стартовая подвыборка — len(X_train) // factor^k: последний раунд идёт на всех строках без
+    # остатка от деления (округление вверх сократило бы число раундов), первый — не меньше чем
+    # на TUNE_MIN_ROWS строках
+    n_rounds = int(np.ceil(np.log(n_candidates) / np.log(HALVING_FACTOR))) + 1
+    max_steps = int(np.log(max(len(X_train) / TUNE_MIN_ROWS, 1)) // np.log(HALVING_FACTOR))
+    min_rows = len(X_train) // HALVING_FACTOR ** min(n_rounds - 1, max_steps)
+
+    if max_steps == 0:
+        # Подвыборок меньше всех строк нет: все раунды шли бы на полных данных — дороже полного перебора
+        print(f"   Строк меньше {TUNE_MIN_ROWS * HALVING_FACTOR:,} — отсеивать не на чем, перебираем сетку целиком")
+        search = GridSearchCV(RandomForestRegressor(random_state=42, n_jobs=1), PARAM_GRID,
+                              cv=cv, scoring='neg_mean_absolute_error', n_jobs=n_jobs, refit=False)
+    else:
+        search = HalvingGridSearchCV(
+            RandomForestRegressor(random_state=42, n_jobs=1), PARAM_GRID,
+            factor=HALVING_FACTOR, resource='n_samples', min_resources=min_rows, aggressive_elimination=True,
+            cv=cv, scoring='neg_mean_absolute_error', n_jobs=n_jobs, refit=False, random_state=42,
+        )
+    started = time.perf_counter()
+    search.fit(X_train, y_train)
+    elapsed = time.perf_counter() - started
+    halving = max_steps > 0
+
+    # Лучшая конфигурация — на всей обучающей выборке и на всех воркерах: встроенный refit
+    # поиска обучал бы её с n_jobs=1 базовой модели
+    started = time.perf_counter()
+    model = clone(search.estimator).set_params(**search.best_params_, n_jobs=n_jobs)
+    model.fit(X_train, y_train)
+    refit_elapsed = time.perf_counter() - started
+
+    if halving:
+        rounds = list(zip(search.n_candidates_, search.n_resources_))
+    else:
+        rounds = [(n_candidates, len(X_train))]
+    for i, (candidates, resources) in enumerate(rounds, 1):
+        print(f"   Раунд {i}: {candidates:3d} конфигураций × {resources:,} строк")
+    print(f"🏆 Лучшие параметры: {search.best_params_}")
+    print(f"🏆 CV MAE лучшей конфигурации: ${-search.best_score_:,.2f}")
+    print(f"🤖 Лучшая конфигурация обучена на {len(X_train):,} строках за {refit_elapsed:,.1f} с")
+
+    report = {
+        'strategy': 'halving' if halving else 'grid',
+        'best_params': search.best_params_,
+        'best_cv_mae': float(-search.best_score_),
+        'candidates': n_candidates,
+        'rounds': [{'candidates': int(c), 'rows': int(r)} for c, r in rounds],
+        'refit_s': round(refit_elapsed, 3),
+        'tuning_s': round(elapsed + refit_elapsed, 3),
+    }
+    if halving:
+        # Оценка полного перебора по первому раунду — там обучались все конфигурации:
+        # время каждой масштабируется линейно на все строки (для деревьев это оценка снизу)
+        results = search.cv_results_
+        first_round = results['iter'] == 0
+        scale = len(X_train) / search.n_resources_[0]
+        naive_estimate = float(np.sum(results['mean_fit_time'][first_round])) * scale * CV_FOLDS / workers
+        print(f"⏱️ Successive halving: {elapsed:,.1f} с; полный перебор сетки — оценочно {naive_estimate:,.1f} с "
+              f"(x{naive_estimate / elapsed:,.1f}); всего с обучением лучшей: {elapsed + refit_elapsed:,.1f} с")
+        report.update(halving_s=round(elapsed, 3), naive_grid_estimate_s=round(naive_estimate, 3))
+    else:
+        print(f"⏱️ Полный перебор: {elapsed:,.1f} с; всего с обучением лучшей: {elapsed + refit_elapsed:,.1f} с")
+        report.update(naive_grid_s=round(elapsed, 3))
+
+    if compare_grid and halving:
+        print("⏳ Для сравнения запускаем полный перебор сетки (GridSearchCV)...")
+        grid = GridSearchCV(RandomForestRegressor(random_state=42, n_jobs=1), PARAM_GRID,
+                            cv=cv, scoring='neg_mean_absolute_error', n_jobs=n_jobs, refit=False)
+        started = time.perf_counter()
+        grid.fit(X_train, y_train)
+        grid_elapsed = time.perf_counter() - started
+        print(f"⏱️ Полный перебор: {grid_elapsed:,.1f} с (x{grid_elapsed / elapsed:,.1f} к successive halving), "
+              f"лучший CV MAE: ${-grid.best_score_:,.2f}, параметры: {grid.best_params_}")
+        report.update(naive_grid_s=round(grid_elapsed, 3), naive_grid_best_params=grid.best_params_,
+                      naive_grid_best_cv_mae=float(-grid.best_score_))
+
+    return model, report
+
+
+def main(n_jobs=-1, chunksize=None, use_cache=True, headless=False, plots=True, metrics_path=None,
+         tune=False, compare_grid=False, promote=True):
+    timer = PhaseTimer()
+    if headless:
+        # Без дисплея: неинтерактивный backend, окна не открываются
+        import matplotlib
+        matplotlib.use('Agg')
+    print(f"⚙️ Воркеров: {joblib.effective_n_jobs(n_jobs)} (n_jobs={n_jobs})")
+    print("🚀 Загружаем данные из файла:", DATA_PATH)
+
+    # Граница прочитанного — с неё продолжит дообучение (--incremental)
+    from incremental import complete_size, save_state
+    data_end = complete_size(DATA_PATH) if os.path.exists(DATA_PATH) else 0
+
+    # Подготовленный набор берём из кэша, если CSV не менялся
+    cached = None
+    if use_cache and os.path.exists(DATA_PATH):
+        key = cache_key(DATA_PATH)
+        cached = load_cached_dataset(key)
+        if cached is not None:
+            print(f"⚡ CSV не изменился — берём подготовленные данные из кэша ({key})")
+
+    if cached is not None:
+        X, y = cached
+    elif chunksize:
+        X, y = load_dataset_chunked(DATA_PATH, chunksize)
+    else:
+        X, y = load_dataset(DATA_PATH, timer)
+
+    print(f"\n📊 Размер данных после обработки: {X.shape[0]} строк, {X.shape[1]} признаков")
+    if X.shape[0] == 0 or X.shape[1] == 0:
+        raise ValueError("❌ Данные пусты после обработки. Проверьте входной файл.")
+    if cached is not None:
+        timer.lap("Загрузка из кэша")
+    else:
+        timer.lap("Загрузка и предобработка (чанки)" if chunksize else "Предобработка")
+        if use_cache:
+            entry_dir = save_cached_dataset(key, X, y, source=DATA_PATH)
+            print(f"🗄️ Подготовленные данные сохранены в кэш: {entry_dir}")
+            timer.lap("Запись кэша")
+
+    # Разделяем на обучающую и тестовую выборки
+    print("🧩 Разделяем данные на обучающую и тестовую выборки...")
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+
+    # Создаём и обучаем модель
+    tuning_report = None
+    if tune:
+        try:
+            model, tuning_report = tune_hyperparameters(X_train, y_train, n_jobs, compare_grid)
+        except Exception as e:
+            raise Exception(f"❌ Ошибка при подборе гиперпараметров: {e}")
+        timer.lap("Подбор гиперпараметров")
+    else:
+        print("🤖 Обучаем модель Random Forest...")
+        model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=n_jobs)
+        try:
+            model.fit(X_train, y_train)
+        except Exception as e:
+            raise Exception(f"❌ Ошибка при обучении модели: {e}")
+        timer.lap("Обучение")
+
+    # 🔄 Кросс-валидация на обучающей выборке
+    folds_jobs, trees_jobs = split_n_jobs(n_jobs)
+    print(f"\n🧪 Запускаем кросс-валидацию ({CV_FOLDS} фолдов, параллельно: {folds_jobs} фолд(а) × {trees_jobs} пот. на деревья)...")
+    cv = KFold(n_splits=CV_FOLDS, shuffle=True, random_state=42)
+
+    # Один проход: каждый фолд обучается один раз и оценивается сразу по всем метрикам
+    cv_results = cross_validate(
+        clone(model).set_params(n_jobs=trees_jobs), X_train, y_train, cv=cv, n_jobs=folds_jobs,
+        scoring={
+            'mae': 'neg_mean_absolute_error',
+            'mse': 'neg_mean_squared_error',
+            'r2': 'r2',
+        },
+    )
+    # MAE
+    cv_scores_mae = -cv_results['test_mae']
+    # RMSE
+    cv_scores_rmse = np.sqrt(-cv_results['test_mse'])
+    # R²
+    cv_scores_r2 = cv_results['test_r2']
+
+    print(f"📊 CV MAE: ${cv_scores_mae.mean():,.2f} ± ${cv_scores_mae.std():,.2f}")
+    print(f"📊 CV RMSE: ${cv_scores_rmse.mean():,.2f} ± ${cv_scores_rmse.std():,.2f}")
+    print(f"📊 CV R²: {cv_scores_r2.mean():.3f} ± {cv_scores_r2.std():.3f}")
+    timer.lap("Кросс-валидация")
+
+    # 📊 Визуализация кросс-валидации (в headless-режиме — после сохранения модели)
+    cv_scores = (cv_scores_mae, cv_scores_rmse, cv_scores_r2)
+    if not headless:
+        plot_cv_results(*cv_scores)
+        timer.lap("Графики CV")
+        show_plots()
+        timer.restart()
+
     # Оцениваем точность на отложенной выборке
     print("\n📈 Оцениваем качество модели на тестовой выборке...")
     y_pred = model.predict(X_test)
@@ -236,53 +658,136 @@ def main():
     if r2 < 0:
         print("⚠️ Внимание: R² отрицательный — модель работает хуже, чем просто среднее значение. Проверьте данные!")
 
-    # 🎨 Построение диагностики модели
-    print("\n🖼️ Строим графики истинных vs предсказанных цен...")
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 6))
-
-    # График 1: Истинные vs Предсказанные цены
-    ax1.scatter(y_test, y_pred, alpha=0.7, color='#3498db', edgecolors='w', s=60)
-    ax1.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--', lw=2, label='Идеальное предсказание')
-    ax1.set_xlabel('Истинная цена ($)', fontsize=12)
-    ax1.set_ylabel('Предсказанная цена ($)', fontsize=12)
-    ax1.set_title('Истинные vs Предсказанные цены', fontsize=14, fontweight='bold')
-    ax1.legend()
-    ax1.grid(True, alpha=0.3)
-
-    # График 2: Распределение ошибок
-    errors = y_test - y_pred
-    ax2.hist(errors, bins=30, color='#e74c3c', edgecolor='black', alpha=0.7)
-    ax2.set_xlabel('Ошибка (Истинная - Предсказанная)', fontsize=12)
-    ax2.set_ylabel('Количество', fontsize=12)
-    ax2.set_title('Распределение ошибок', fontsize=14, fontweight='bold')
-    ax2.grid(True, alpha=0.3)
-
-    plt.tight_layout()
-    plt.savefig('data/model_diagnostics.png', dpi=150, bbox_inches='tight')
-    print("📊 Диагностические графики сохранены: data/model_diagnostics.png")
-    plt.show()
-
-    # Сохраняем модель и список признаков
-    print(f"\n💾 Сохраняем модель в {MODEL_PATH}...")
-    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    timer.lap("Оценка на тесте")
 
+    # 🎨 Построение диагностики модели
+    if not headless:
+        plot_diagnostics(y_test, y_pred)
+        timer.lap("Графики диагностики")
+        show_plots()
+        timer.restart()
+
+    # Артефакты пишем во временный каталог реестра и публикуем новой версией целиком —
+    # приложение не увидит недописанный pickle
+    staging_dir, paths = model_registry.create_staging()
+    print(f"\n💾 Сохраняем модель, список признаков и кодировщик...")
     try:
-        joblib.dump(model, MODEL_PATH)
-        joblib.dump(X.columns.tolist(), FEATURES_PATH)
-        print("🎉 Модель и список признаков успешно сохранены!")
+        joblib.dump(model, paths['model'])
+        joblib.dump(X.columns.tolist(), paths['features'])
+        ShipEncoder(X.columns).save(paths['encoder'])
+
+        # Плоские массивы деревьев — компактный артефакт для быстрого инференса
+        forest = export_forest(model, paths['forest'], X.columns.tolist())
+        print(f"🌲 Лес экспортирован в плоский формат: {forest.n_trees} деревьев, {forest.n_nodes:,} узлов")
     except Exception as e:
+        model_registry.discard_staging(staging_dir)
         raise Exception(f"❌ Ошибка при сохранении модели: {e}")
 
+    # Модель хуже среднего не выкатываем автоматически, даже если переключение разрешено
+    promoted = promote and r2 >= 0
+    version = model_registry.publish(staging_dir, make_current=promoted, source='train', rows=int(len(X)),
+                                     test_mae=round(float(mae), 2), test_r2=round(float(r2), 4))
+    print(f"🎉 Опубликована версия модели {version}: {os.path.join(model_registry.REGISTRY_DIR, version)}")
+    if not promoted:
+        print(f"⏸️ Версия не сделана текущей{' (R² отрицательный)' if promote else ''}. "
+              f"Выкатить после проверки: python model_registry.py --promote {version}")
+
+    if X.attrs.get('categories'):
+        save_state(DATA_PATH, data_end, X.columns, X.attrs['categories'], len(X), forest.n_trees,
+                   base_trees=forest.n_trees, version=version, date_format=X.attrs.get('date_format'))
+        print("📌 Состояние для дообучения сохранено: data/train_state.json")
+    timer.lap("Сохранение")
+
+    # Графики в headless-режиме строятся в отдельном процессе и не задерживают пайплайн
+    plot_process = None
+    if headless and plots:
+        plot_process = multiprocessing.Process(
+            target=render_plots, args=(cv_scores, y_test.to_numpy(), np.asarray(y_pred)), name='plots')
+        plot_process.start()
+        print(f"🖼️ Графики строятся в фоновом процессе (pid {plot_process.pid})")
+
     # Дополнительно: выводим 5 самых важных признаков
     print("\n🔝 Топ-5 важных признаков:")
     feature_importances = pd.Series(model.feature_importances_, index=X.columns).sort_values(ascending=False)
     for i, (feat, imp) in enumerate(feature_importances.head().items(), 1):
         print(f"{i}. {feat}: {imp:.4f}")
 
+    timer.report()
+    peak = peak_memory_mb()
+    if peak is not None:
+        print(f"💾 Пиковая память процесса: {peak:,.0f} МБ")
+
+    if metrics_path:
+        write_metrics(metrics_path, {
+            'status': 'ok',
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'data': {'rows': int(X.shape[0]), 'features': int(X.shape[1]),
+                     'train_rows': int(len(X_train)), 'test_rows': int(len(X_test))},
+            'cv': {
+                'folds': CV_FOLDS,
+                'mae': {'mean': float(cv_scores_mae.mean()), 'std': float(cv_scores_mae.std())},
+                'rmse': {'mean': float(cv_scores_rmse.mean()), 'std': float(cv_scores_rmse.std())},
+                'r2': {'mean': float(cv_scores_r2.mean()), 'std': float(cv_scores_r2.std())},
+            },
+            'test': {'mae': float(mae), 'rmse': float(rmse), 'mape': float(mape), 'r2': float(r2)},
+            'model_params': {name: model.get_params()[name] for name in PARAM_GRID},
+            'tuning': tuning_report,
+            'timings_s': {name: round(elapsed, 3) for name, elapsed in timer.phases.items()},
+            'peak_memory_mb': peak,
+            'model_version': version,
+            'promoted': promoted,
+            'artifacts': model_registry.version_paths(version),
+        })
+        print(f"🧾 Метрики сохранены в JSON: {metrics_path}")
+
+    if plot_process is not None:
+        plot_process.join()
+        print("🖼️ Фоновое построение графиков завершено")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обучение модели предсказания цены судна")
+    parser.add_argument('--n-jobs', type=int, default=-1,
+                        help="Число воркеров для обучения и кросс-валидации (-1 — все ядра)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Читать CSV потоково чанками по N строк (для больших файлов)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Не использовать кэш подготовленных данных (data/cache)")
+    parser.add_argument('--headless', action='store_true',
+                        help="Режим без дисплея: модель сохраняется сразу, графики строятся в фоне (backend Agg)")
+    parser.add_argument('--no-plots', action='store_true',
+                        help="Не строить графики")
+    parser.add_argument('--metrics-json', default=None,
+                        help=f"Куда записать метрики в JSON (в headless-режиме по умолчанию {METRICS_PATH})")
+    parser.add_argument('--tune', action='store_true',
+                        help="Подобрать гиперпараметры (successive halving) и сохранить лучшую модель; графики — в фоне")
+    parser.add_argument('--compare-grid', action='store_true',
+                        help="Вместе с --tune: для сравнения прогнать полный перебор сетки")
+    parser.add_argument('--no-promote', action='store_true',
+                        help="Опубликовать версию в реестре, но не делать её текущей (выкатка — model_registry.py --promote)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Дообучить модель только на строках, дописанных в CSV после прошлого запуска")
+    parser.add_argument('--new-trees', type=int, default=20,
+                        help="Сколько деревьев добавлять при дообучении")
+    parser.add_argument('--max-trees', type=int, default=300,
+                        help="Максимум деревьев в лесу: самые старые отбрасываются")
+    parser.add_argument('--min-new-rows', type=int, default=50,
+                        help="Минимум новых строк для дообучения (меньше — ждём следующего запуска)")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main()
+        if args.incremental:
+            from incremental import update_model
+            update_model(DATA_PATH, n_new_trees=args.new_trees, max_trees=args.max_trees,
+                         min_new_rows=args.min_new_rows, n_jobs=args.n_jobs, promote=not args.no_promote)
+        else:
+            main(n_jobs=args.n_jobs, chunksize=args.chunksize, use_cache=not args.no_cache,
+                 headless=args.headless or args.no_plots or args.tune, plots=not args.no_plots,
+                 metrics_path=args.metrics_json or (METRICS_PATH if args.headless or args.tune else None),
+                 tune=args.tune, compare_grid=args.compare_grid, promote=not args.no_promote)
     except Exception as e:
         print(f"\n❌ КРИТИЧЕСКАЯ ОШИБКА: {e}")
         print("💡 Совет: проверьте формат данных, наличие столбцов, разделитель в CSV и путь к файлу.")